@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing a persistent cache of audio file analyses.
+"""
+
+from __future__ import division
+from hashlib import sha1
+from time import time
+import os
+
+import gobject
+from numpy import load
+
+from audio.offline import analyze
+
+
+# analysis parameters used when not specified (see offline.analyze).
+DEFAULTS = {
+        'product': 'stft',
+        'size': 2048,
+        'hop': 512,
+        'window': 'hann',
+        'bands': 128,
+        'fmin': 20,
+        'fmax': 20000,
+        'scale': 'log',
+        'rate': 44100,
+}
+
+
+class Cache(object):
+    """On-disk cache of spectrograms (and other offline.analyze products).
+
+    Entries are .npy files keyed by the identity of the audio file and by
+    the analysis parameters, and are returned memory-mapped. When the total
+    size of the entries exceeds the capacity, the least recently used ones
+    are removed.
+    """
+
+    def __init__(self, directory=None, capacity=1 << 30, content=False):
+        """Constructor.
+
+        Keywords:
+            directory directory containing the entries (defaults to
+                      ~/.cache/audio).
+            capacity maximum size of the entries in bytes.
+            content flag indicating wether to identify files by the hash of
+                    their content instead of by their size and mtime.
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'audio')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.capacity = capacity
+        self.content = content
+
+    def identity(self, location):
+        """Return a string identifying the given file.
+        """
+        location = os.path.abspath(location)
+        if not self.content:
+            info = os.stat(location)
+            return '{0}:{1}:{2}'.format(location, info.st_size,
+                                        info.st_mtime)
+
+        digest = sha1()
+        with open(location, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), ''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, location, params):
+        """Return the location of the entry of the given file and params.
+
+        Keywords:
+            location location of the audio file.
+            params complete dictionary of analysis parameters.
+        """
+        key = sha1(repr((self.identity(location),
+                         sorted(params.items())))).hexdigest()
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, location, **params):
+        """Return the cached analysis of the given file, if any.
+
+        Keywords:
+            location location of the audio file.
+            params analysis parameters (see offline.analyze).
+
+        Return:
+            Memory-mapped array, or None on cache misses.
+        """
+        return self.load(self.path(location, dict(DEFAULTS, **params)))
+
+    def load(self, path):
+        """Load the given entry and mark it as recently used.
+        """
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return load(path, mmap_mode='r')
+
+    def analyze(self, location, **params):
+        """Return the analysis of the given file, computing it if needed.
+
+        Keywords:
+            location location of the audio file.
+            params analysis parameters (see offline.analyze).
+
+        Return:
+            Memory-mapped array.
+        """
+        params = dict(DEFAULTS, **params)
+        path = self.path(location, params)
+        data = self.load(path)
+        if data is not None:
+            return data
+
+        partial = path + '.part'
+        try:
+            analyze(location, partial, **params)
+            os.rename(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.evict(keep=path)
+        return self.load(path)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries exceeding the capacity.
+
+        Keywords:
+            keep location of an entry never removed.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                info = os.stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+        entries.sort()
+
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.capacity:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+
+class Replay(gobject.GObject):
+    """Emit the rows of a precomputed analysis in real time.
+
+    Rows are emitted with the same 'new-data' signal of the sources; replay
+    spectrograms ('stft' product) into an Analyzer created with
+    spectrum=True to display them without decoding anything.
+    """
+
+    __gsignals__ = {
+            'new-data': (gobject.SIGNAL_RUN_FIRST, None,
+                         (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, data, hop=DEFAULTS['hop'], rate=DEFAULTS['rate']):
+        """Constructor.
+
+        Keywords:
+            data array containing one row for each frame.
+            hop number of samples between the start of consecutive frames.
+            rate sample rate of the analyzed audio signal.
+        """
+        super(Replay, self).__init__()
+
+        self.data = data
+        self.period = hop / rate
+        self.position = 0
+        self.started = None
+        self.timeout = None
+
+    def seek(self, seconds):
+        """Move the current position to the given time.
+
+        Keywords:
+            seconds time from the beginning of the file.
+        """
+        position = int(seconds / self.period)
+        self.position = max(0, min(position, len(self.data)))
+        if self.timeout is not None:
+            self.started = time(), self.position
+
+    def start(self):
+        """Start emitting rows in real time from the current position.
+        """
+        if self.timeout is not None:
+            return
+        self.started = time(), self.position
+        interval = max(1, int(1000 * self.period))
+        self.timeout = gobject.timeout_add(interval, self.tick_cb)
+
+    def tick_cb(self):
+        """Emit the last row due since the replay was started.
+
+        Rows skipped because of late ticks are not emitted.
+        """
+        started, position = self.started
+        due = position + int((time() - started) / self.period)
+        if due >= len(self.data):
+            self.position = len(self.data)
+            self.timeout = None
+            return False
+        if due >= self.position:
+            self.position = due + 1
+            self.emit('new-data', self.data[due])
+        return True
+
+    def pause(self):
+        """Stop emitting rows, keeping the current position.
+        """
+        if self.timeout is not None:
+            gobject.source_remove(self.timeout)
+            self.timeout = None
+
+    def stop(self):
+        """Stop emitting rows and rewind.
+        """
+        self.pause()
+        self.position = 0
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing the incremental extraction of audio features.
+
+Features are computed frame by frame, keeping a constant amount of state
+between frames (smoothed levels, previous spectrum and flux average), and
+every computation is vectorized across a batch of streams: a 2-D input
+holds one frame per row, each row belonging to a different stream.
+"""
+
+from __future__ import division
+
+from numpy import abs
+from numpy import arange
+from numpy import asarray
+from numpy import exp
+from numpy import float64
+from numpy import maximum
+from numpy import sqrt
+from numpy import subtract
+from numpy import where
+from numpy import zeros
+
+from audio.util import FFT
+
+
+# features available, and the ones computed in the time domain only.
+FEATURES = ('rms', 'peak', 'centroid', 'rolloff', 'flux', 'onset')
+TIME_FEATURES = ('rms', 'peak')
+
+
+class Features(object):
+    """Extract features from consecutive frames of one or more streams.
+
+    Instances keep the state of the streams between calls, hence they can
+    be used as the analysis of a worker (see audio.worker).
+    """
+
+    def __init__(self, features=FEATURES, window='hann', rate=44100,
+                 hop=None, attack=.01, release=.3, rolloff=.85,
+                 sensitivity=1.5, threshold=1e-3, memory=1):
+        """Constructor.
+
+        Keywords:
+            features names of the features to compute (see FEATURES): when
+                     only time domain features are requested no fft is
+                     computed.
+            window name of the window function applied before the fft.
+            rate sample rate of the input audio signal.
+            hop number of samples between the start of consecutive frames;
+                if None frames are supposed not to overlap.
+            attack time constant of rising levels, in seconds.
+            release time constant of falling levels, in seconds.
+            rolloff fraction of the spectral energy below the rolloff
+                    frequency.
+            sensitivity ratio between the spectral flux and its running
+                        average above which an onset is detected.
+            threshold minimum spectral flux of an onset, so that numerical
+                      ripple of steady signals is never detected.
+            memory time constant of the running average of the flux, in
+                   seconds; no onset is detected during the first memory
+                   seconds, while the average warms up.
+        """
+        for name in features:
+            if name not in FEATURES:
+                raise ValueError('Unknown feature: {0}'.format(name))
+
+        self.features = tuple(features)
+        self.spectral = any(name not in TIME_FEATURES for name in features)
+        self.engine = FFT(window)
+        self.rate = rate
+        self.hop = hop
+        self.attack = attack
+        self.release = release
+        self.rolloff = rolloff
+        self.sensitivity = sensitivity
+        self.threshold = threshold
+        self.memory = memory
+        self.reset()
+
+    def reset(self):
+        """Discard the state of the streams.
+        """
+        self.levels = None
+        self.previous = None
+        self.average = None
+        self.measured = 0
+
+    def coefficient(self, interval, constant):
+        """Return the smoothing coefficient of the given time constant.
+
+        Keywords:
+            interval number of seconds between consecutive frames.
+            constant time constant in seconds.
+        """
+        return exp(-interval / constant) if constant > 0 else 0.
+
+    def smooth(self, level, value, interval):
+        """Apply the attack/release ballistics to the given levels in place.
+
+        Keywords:
+            level array of smoothed levels, updated in place.
+            value array of new levels.
+            interval number of seconds between consecutive frames.
+        """
+        coefficient = where(value > level,
+                            self.coefficient(interval, self.attack),
+                            self.coefficient(interval, self.release))
+        # level = value + coefficient * (level - value)
+        subtract(level, value, out=level)
+        level *= coefficient
+        level += value
+        return level
+
+    def __call__(self, frames):
+        """Extract the features of the given frames.
+
+        Keywords:
+            frames array of samples bounded between -1 and 1, one frame per
+                   row for batches of streams (multichannel frames of shape
+                   (frames, channels) can be passed transposed, one stream
+                   per channel).
+
+        Return:
+            Dictionary containing the requested features, one value per
+            stream for batches:
+                rms smoothed RMS level.
+                peak smoothed peak level.
+                centroid spectral centroid in hertz.
+                rolloff rolloff frequency in hertz.
+                flux spectral flux (positive magnitude differences).
+                onset flag indicating wether an onset was detected.
+        """
+        frames = asarray(frames)
+        single = frames.ndim == 1
+        rows = frames[None, :] if single else frames
+        streams, size = rows.shape
+        interval = (self.hop if self.hop else size) / self.rate
+
+        if self.levels is None or len(self.levels[0]) != streams:
+            self.levels = (zeros(streams, float64), zeros(streams, float64))
+            self.previous = self.average = None
+
+        result = {}
+        if 'rms' in self.features:
+            rms = sqrt((rows * rows).mean(axis=-1))
+            result['rms'] = self.smooth(self.levels[0], rms, interval)
+        if 'peak' in self.features:
+            peak = abs(rows).max(axis=-1)
+            result['peak'] = self.smooth(self.levels[1], peak, interval)
+
+        if self.spectral:
+            result.update(self.spectral_features(rows, interval))
+
+        values = {}
+        for name in self.features:
+            value = result[name]
+            if single:
+                value = bool(value[0]) if name == 'onset' else \
+                        float(value[0])
+            else:
+                value = value.copy()
+            values[name] = value
+        return values
+
+    def spectral_features(self, rows, interval):
+        """Extract the spectral features of the given batch of frames.
+
+        Return:
+            Dictionary containing the spectral features of each stream.
+        """
+        plan = self.engine.plan(rows.shape[-1])
+        magnitude = self.engine.magnitude(rows)
+        power = plan.buffer('power', magnitude.shape)
+        power[...] = magnitude
+        power *= magnitude
+        freqs = arange(plan.bins) * self.rate / plan.length
+
+        result = {}
+        total = magnitude.sum(axis=-1)
+        result['centroid'] = (magnitude * freqs).sum(axis=-1) / \
+                             maximum(total, 1e-15)
+
+        cumulative = power.cumsum(axis=-1)
+        threshold = self.rolloff * cumulative[:, -1:]
+        result['rolloff'] = freqs[(cumulative < threshold).sum(axis=-1)
+                                  .clip(0, plan.bins - 1)]
+
+        if self.previous is None or self.previous.shape != magnitude.shape:
+            # the first frame has no flux.
+            self.previous = magnitude.copy()
+            self.average = zeros(len(rows), float64)
+            self.measured = -1
+        difference = plan.buffer('difference', magnitude.shape)
+        subtract(magnitude, self.previous, out=difference)
+        maximum(difference, 0, out=difference)
+        flux = difference.sum(axis=-1)
+        self.previous[...] = magnitude
+        self.measured += 1
+
+        result['flux'] = flux
+        if self.measured * interval < self.memory:
+            # warming up: the average is the mean of the measured fluxes.
+            result['onset'] = zeros(len(rows), bool)
+            if self.measured:
+                self.average += (flux - self.average) / self.measured
+            return result
+
+        result['onset'] = (flux > self.sensitivity * self.average) & \
+                          (flux > self.threshold)
+        coefficient = self.coefficient(interval, self.memory)
+        self.average *= coefficient
+        self.average += (1 - coefficient) * flux
+        return result
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing the analysis shared by the subscribers of a source.
+
+A hub copies each frame emitted by a source once, and wraps it in a Frame
+object emitted to its subscribers. Derived products (spectrum, bands,
+envelope and levels) are computed by the frame lazily, the first time a
+subscriber asks for them, and cached: any number of visualizers connected
+to the same hub share the work. Returned arrays are read-only, since they
+are shared.
+"""
+
+from __future__ import division
+from threading import RLock
+
+import gobject
+from numpy import abs
+from numpy import array
+from numpy import float32
+from numpy import sqrt
+
+from audio.util import bandmap
+from audio.util import envelope
+from audio.util import FFT
+from audio.util import select
+
+
+def readonly(data):
+    """Flag the given array as read-only and return it.
+    """
+    data.setflags(write=False)
+    return data
+
+
+class Frame(object):
+    """Frame of data emitted by a hub, caching its derived products.
+    """
+
+    def __init__(self, hub, data, index):
+        """Constructor.
+
+        Keywords:
+            hub hub emitting the frame.
+            data read-only array of samples bounded between -1 and 1, with
+                 shape (frames, channels) for multichannel data.
+            index sequence number of the frame.
+        """
+        self.hub = hub
+        self.data = data
+        self.index = index
+        self.rate = hub.rate
+        self.products = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def product(self, key, compute):
+        """Return the product with the given key, computing it if needed.
+
+        Keywords:
+            key hashable identifier of the product.
+            compute callable returning the product, invoked at most once.
+        """
+        result = self.products.get(key)
+        if result is None:
+            with self.hub.lock:
+                result = self.products.get(key)
+                if result is None:
+                    result = self.products[key] = readonly(compute())
+        return result
+
+    def samples(self, channel='mix'):
+        """Return the samples of the given channel (see util.select).
+        """
+        if self.data.ndim == 1:
+            return self.data
+        return self.product(('samples', channel),
+                            lambda: array(select(self.data, channel),
+                                          float32))
+
+    def spectrum(self, window='hann', channel='mix'):
+        """Return the spectrum of the given channel, in dB.
+
+        Keywords:
+            window name of the window function applied before the fft.
+            channel channel of multichannel data (see util.select).
+        """
+        def compute():
+            # the engine reuses its work buffers, results must be copied.
+            return self.hub.engine(window).decibel(
+                    self.samples(channel)).copy()
+        return self.product(('spectrum', window, channel), compute)
+
+    def bands(self, bands=128, fmin=20, fmax=20000, scale='log',
+              window='hann', channel='mix'):
+        """Return the spectrum of the given channel merged into bands.
+
+        Keywords:
+            bands number of bands.
+            fmin lowest frequency of the first band.
+            fmax highest frequency of the last band.
+            scale spacing of the bands: 'linear', 'log' or 'mel'.
+            window name of the window function applied before the fft.
+            channel channel of multichannel data (see util.select).
+        """
+        def compute():
+            spectrum = self.spectrum(window, channel)
+            length = self.hub.engine(window).plan(len(self.data)).length
+            return bandmap(length, self.rate, bands, fmin, fmax,
+                           scale)(spectrum)
+        return self.product(('bands', bands, fmin, fmax, scale, window,
+                             channel), compute)
+
+    def envelope(self, points, channel='mix'):
+        """Return the min/max envelope of the given channel.
+
+        Keywords:
+            points number of points of the envelope.
+            channel channel of multichannel data (see util.select).
+
+        Return:
+            Tuple containing the minimum and maximum arrays.
+        """
+        result = self.product(
+                ('envelope', points, channel),
+                lambda: array(envelope(self.samples(channel), points)))
+        return result[0], result[1]
+
+    def levels(self, channel='mix'):
+        """Return the RMS and peak levels of the given channel.
+
+        Return:
+            Array containing the RMS and the peak level.
+        """
+        def compute():
+            data = self.samples(channel)
+            return array([sqrt((data * data).mean()), abs(data).max()])
+        return self.product(('levels', channel), compute)
+
+
+class Hub(gobject.GObject):
+    """Share the analysis of the data emitted by a source.
+
+    Each new frame is copied once and emitted as a Frame object, that
+    visualizers accept in place of raw data (see Visualizer.refresh).
+    """
+
+    __gsignals__ = {
+            'new-data': (gobject.SIGNAL_RUN_FIRST, None,
+                         (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, source, rate=44100):
+        """Constructor.
+
+        Keywords:
+            source audio source (or framer) emitting new data.
+            rate sample rate of the input audio signal.
+        """
+        super(Hub, self).__init__()
+
+        self.rate = rate
+        # products may depend on other products, and engines reuse their
+        # work buffers: computations are serialized.
+        self.lock = RLock()
+        self.engines = {}
+        self.frame = None
+        self.count = 0
+
+        self.handler = source.connect('new-data', self.new_data_cb)
+        self.source = source
+
+    def engine(self, window):
+        """Return the fft engine using the given window.
+        """
+        engine = self.engines.get(window)
+        if engine is None:
+            engine = self.engines[window] = FFT(window)
+        return engine
+
+    def new_data_cb(self, source, data):
+        """Wrap a copy of the new data in a frame and emit it.
+        """
+        self.count += 1
+        self.frame = Frame(self, readonly(array(data, float32)), self.count)
+        self.emit('new-data', self.frame)
+
+    def disconnect_source(self):
+        """Stop receiving data from the source.
+        """
+        self.source.disconnect(self.handler)
@@ -0,0 +1,422 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing functions used to analyze audio files offline.
+"""
+
+from __future__ import division
+from argparse import ArgumentParser
+from hashlib import sha1
+from multiprocessing import Pool
+from struct import pack
+from time import time
+import os
+import sys
+
+from numpy import ascontiguousarray
+from numpy import dtype as _dtype
+from numpy import empty
+from numpy import float32
+from numpy import sqrt
+from numpy.lib.format import dtype_to_descr
+from numpy.lib.format import magic
+
+from audio.source import AudioFile
+from audio.source import Framer
+from audio.util import bandmap
+from audio.util import FFT
+
+
+# products computed by analyze().
+PRODUCTS = ('stft', 'bands', 'levels')
+
+# extensions of the files analyzed when scanning directories.
+EXTENSIONS = ('.aac', '.aiff', '.flac', '.m4a', '.mp3', '.ogg', '.wav',
+              '.wma')
+
+
+class NpyWriter(object):
+    """Write rows of data to a .npy file without knowing their number.
+
+    The header has a fixed size, hence it is rewritten with the final
+    number of rows when the writer is closed. The resulting file can then
+    be opened with numpy.load, optionally memory-mapped.
+    """
+
+    HEADER = 128
+
+    def __init__(self, path, columns, dtype=float32):
+        """Constructor.
+
+        Keywords:
+            path location of the output file.
+            columns number of values of each row.
+            dtype type of the stored values.
+        """
+        self.file = open(path, 'wb')
+        self.columns = columns
+        self.dtype = _dtype(dtype)
+        self.rows = 0
+        self.write_header()
+
+    def write_header(self):
+        """Write the header describing the rows written so far.
+        """
+        prefix = magic(1, 0)
+        header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1}, " \
+                 "{2}), }}".format(dtype_to_descr(self.dtype), self.rows,
+                                   self.columns)
+        # the header ends with a newline, and is padded with spaces.
+        header = header.ljust(self.HEADER - len(prefix) - 2 - 1) + '\n'
+        self.file.write(prefix + pack('<H', len(header)) + header)
+
+    def write(self, rows):
+        """Append the given rows.
+
+        Keywords:
+            rows 2-D array of values (or a 1-D array containing a single row).
+        """
+        rows = ascontiguousarray(rows, self.dtype).reshape(-1, self.columns)
+        rows.tofile(self.file)
+        self.rows += len(rows)
+
+    def close(self):
+        """Update the header and close the file.
+        """
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+
+
+class Product(object):
+    """Compute a product on batches of frames, writing it to a .npy file.
+
+    Frames are collected in a preallocated block, and analyzed a whole
+    block at a time.
+    """
+
+    def __init__(self, output, product, size, window, bands, fmin, fmax,
+                 scale, rate, block=64):
+        """Constructor.
+
+        Keywords:
+            output location of the output .npy file.
+            product computed product (see PRODUCTS).
+            size number of samples of each frame.
+            window name of the window function applied before the fft.
+            bands number of bands ('bands' product).
+            fmin lowest frequency of the first band ('bands' product).
+            fmax highest frequency of the last band ('bands' product).
+            scale spacing of the bands ('bands' product).
+            rate sample rate of the audio signal.
+            block number of frames analyzed at once.
+        """
+        if product not in PRODUCTS:
+            raise ValueError('Unknown product: {0}'.format(product))
+
+        self.product = product
+        self.engine = FFT(window)
+        self.block = empty((block, size), float32)
+        self.count = 0
+
+        length = self.engine.plan(size).length
+        if product == 'stft':
+            columns = length // 2
+        elif product == 'bands':
+            columns = bands
+            self.bands = bandmap(length, rate, bands, fmin, fmax, scale)
+        else:
+            columns = 2 # rms, peak
+        self.writer = NpyWriter(output, columns)
+
+    def new_data_cb(self, framer, frame):
+        """Collect the new frame, analyzing the block when full.
+        """
+        self.block[self.count] = frame
+        self.count += 1
+        if self.count == len(self.block):
+            self.flush()
+
+    def flush(self):
+        """Analyze the collected frames.
+        """
+        frames = self.block[:self.count]
+        self.count = 0
+        if not len(frames):
+            return
+
+        if self.product == 'levels':
+            result = empty((len(frames), 2), float32)
+            result[:, 0] = sqrt((frames * frames).mean(axis=1))
+            result[:, 1] = abs(frames).max(axis=1)
+        else:
+            result = self.engine.decibel(frames)
+            if self.product == 'bands':
+                result = self.bands(result)
+        self.writer.write(result)
+
+    def close(self):
+        """Analyze the remaining frames and close the output file.
+
+        Return:
+            Number of frames written.
+        """
+        self.flush()
+        self.writer.close()
+        return self.writer.rows
+
+
+def analyze(location, output, product='bands', size=2048, hop=512,
+            window='hann', bands=128, fmin=20, fmax=20000, scale='log',
+            rate=44100):
+    """Decode the given audio file as fast as possible and analyze it.
+
+    No audio sink nor sound server is needed. The output .npy file contains
+    one row for each frame:
+        stft the spectrum in dB (one column per bin).
+        bands the spectrum in dB reduced to bands (one column per band).
+        levels the RMS and peak levels of the frame (two columns).
+
+    Keywords:
+        location location of the audio file.
+        output location of the output .npy file.
+        product computed product (see PRODUCTS).
+        size number of samples of each frame.
+        hop number of samples between the start of consecutive frames.
+        window name of the window function applied before the fft.
+        bands number of bands ('bands' product).
+        fmin lowest frequency of the first band ('bands' product).
+        fmax highest frequency of the last band ('bands' product).
+        scale spacing of the bands ('bands' product).
+        rate sample rate the audio file is decoded at.
+
+    Return:
+        Number of analyzed frames.
+    """
+    analysis = Product(output, product, size, window, bands, fmin, fmax,
+                       scale, rate)
+    source = AudioFile(location, offline=True, rate=rate)
+    framer = Framer(source, size, hop)
+    framer.connect('new-data', analysis.new_data_cb)
+    try:
+        source.run()
+    finally:
+        framer.disconnect_source()
+        rows = analysis.close()
+    return rows
+
+
+def output_path(name, outdir, params):
+    """Return the location of the output file of the given audio file.
+
+    The name of the output file contains a digest of the analysis
+    parameters: outputs computed with different parameters never replace
+    each other, and are never mistaken for up to date.
+
+    Keywords:
+        name name of the audio file, relative to the scanned directory (see
+             collect).
+        outdir directory containing the output files.
+        params dictionary of analysis parameters (see analyze).
+    """
+    digest = sha1(repr(sorted(params.items()))).hexdigest()[:8]
+    return os.path.join(outdir, '{0}.{1}-{2}.npy'.format(
+            name, params.get('product', 'bands'), digest))
+
+def uptodate(location, output):
+    """Check wether the output file is newer than the audio file.
+    """
+    return (os.path.exists(output) and
+            os.path.getmtime(output) >= os.path.getmtime(location))
+
+def collect(paths):
+    """Return the audio files found among the given paths.
+
+    Directories are scanned recursively for files having one of the known
+    EXTENSIONS; files found more than once are returned once. Files are
+    named after their path relative to the scanned directory (files given
+    directly after their base name); names shared by more than one file
+    are made unique with a digest of their absolute path.
+
+    Keywords:
+        paths list of files and directories.
+
+    Return:
+        List of pairs containing the location of the audio file and its
+        name.
+    """
+    locations = []
+    for path in paths:
+        if not os.path.isdir(path):
+            locations.append((path, os.path.basename(path)))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    location = os.path.join(root, name)
+                    locations.append((location,
+                                      os.path.relpath(location, path)))
+
+    # files reached through more than one path are analyzed once.
+    seen = set()
+    distinct = []
+    for (location, name) in locations:
+        if os.path.abspath(location) not in seen:
+            seen.add(os.path.abspath(location))
+            distinct.append((location, name))
+    locations = distinct
+
+    counts = {}
+    for (location, name) in locations:
+        counts[name] = counts.get(name, 0) + 1
+    unique = []
+    for (location, name) in locations:
+        if counts[name] > 1:
+            digest = sha1(os.path.abspath(location)).hexdigest()[:8]
+            name = '{0}-{1}'.format(name, digest)
+        unique.append((location, name))
+    return unique
+
+def job(args):
+    """Analyze a single file; run by the processes of the pool.
+
+    The result is written to a temporary file renamed at the end, so that
+    interrupted jobs never leave up to date outputs behind.
+
+    Keywords:
+        args tuple containing the location of the audio file, the location
+             of the output file and the keyword arguments of analyze().
+
+    Return:
+        Tuple containing the location of the audio file, the number of
+        analyzed frames, the elapsed time, and an error message (None on
+        success).
+    """
+    location, output, kwargs = args
+    partial = output + '.part'
+    start = time()
+    try:
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created in the meantime by another process.
+                if not os.path.isdir(directory):
+                    raise
+        frames = analyze(location, partial, **kwargs)
+        os.rename(partial, output)
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return location, 0, time() - start, str(e)
+    return location, frames, time() - start, None
+
+def outdated(locations, outdir, params, force=False):
+    """Return the audio files whose output is not up to date.
+
+    Keywords:
+        locations pairs containing the location and the name of the audio
+                  files (see collect).
+        outdir directory containing the output files.
+        params dictionary of analysis parameters (see analyze).
+        force flag indicating wether to return up to date files too.
+
+    Return:
+        List of pairs containing the location of the audio file and the
+        location of its output file.
+    """
+    pairs = []
+    for (location, name) in locations:
+        output = output_path(name, outdir, params)
+        if force or not uptodate(location, output):
+            pairs.append((location, output))
+    return pairs
+
+def analyze_many(pairs, processes=None, **kwargs):
+    """Analyze the given audio files in parallel.
+
+    Keywords:
+        pairs list of pairs containing the location of the audio file and
+              the location of its output file (see outdated).
+        processes number of processes of the pool (defaults to the number
+                  of cores).
+        kwargs keyword arguments passed to analyze().
+
+    Return:
+        Iterator over the results of each analyzed file (see job), in
+        completion order.
+    """
+    if not pairs:
+        return iter([])
+
+    pool = Pool(processes)
+    results = pool.imap_unordered(job, [(location, output, kwargs)
+                                        for (location, output) in pairs])
+    pool.close()
+    return results
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0],
+                            description='Analyze audio files offline.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='audio file or directory to analyze')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='directory receiving the .npy outputs')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of parallel processes')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='analyze files even if up to date')
+    parser.add_argument('-p', '--product', choices=PRODUCTS,
+                        default='bands')
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--hop', type=int, default=512)
+    parser.add_argument('--window', default='hann')
+    parser.add_argument('--bands', type=int, default=128)
+    parser.add_argument('--fmin', type=float, default=20)
+    parser.add_argument('--fmax', type=float, default=20000)
+    parser.add_argument('--scale', choices=('linear', 'log', 'mel'),
+                        default='log')
+    args = parser.parse_args(argv[1:])
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    params = {
+        'product': args.product,
+        'size': args.size,
+        'hop': args.hop,
+        'window': args.window,
+        'bands': args.bands,
+        'fmin': args.fmin,
+        'fmax': args.fmax,
+        'scale': args.scale,
+    }
+    locations = collect(args.paths)
+    pairs = outdated(locations, args.outdir, params, args.force)
+    results = analyze_many(pairs, args.processes, **params)
+
+    errors = 0
+    done = 0
+    for (location, frames, elapsed, error) in results:
+        done += 1
+        if error is not None:
+            errors += 1
+            print '[{0}/{1}] {2}: {3}'.format(done, len(pairs), location,
+                                              error)
+            continue
+        seconds = 0
+        if frames:
+            seconds = ((frames - 1) * args.hop + args.size) / 44100
+        print '[{0}/{1}] {2}: {3:.1f}s of audio in {4:.1f}s ({5:.0f}x)'.format(
+                done, len(pairs), location, seconds, elapsed,
+                seconds / max(elapsed, 1e-6))
+    print '{0} analyzed, {1} failed, {2} up to date'.format(
+            done - errors, errors, len(locations) - len(pairs))
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
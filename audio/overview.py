@@ -0,0 +1,294 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing multi-resolution overviews of audio waveforms.
+
+An overview is a pyramid of levels: each level splits the signal in
+buckets of a fixed number of samples, and stores the minimum, maximum and
+RMS value of each bucket. Any time range can then be displayed at any
+width reading at most a few buckets per pixel; ranges finer than the
+finest level are reduced from the samples themselves, when available.
+"""
+
+from __future__ import division
+import os
+
+from numpy import add
+from numpy import arange
+from numpy import concatenate
+from numpy import empty
+from numpy import float32
+from numpy import linspace
+from numpy import load
+from numpy import maximum
+from numpy import minimum
+from numpy import multiply
+from numpy import savez
+from numpy import sqrt
+
+from audio.pcm import PcmFile
+from audio.util import SCALE
+
+
+# number of samples of the buckets of each level.
+BUCKETS = (256, 4096, 65536, 1048576)
+
+
+class Overview(object):
+    """Multi-resolution min/max/RMS overview of a waveform.
+    """
+
+    def __init__(self, rate, length, levels, samples=None):
+        """Constructor.
+
+        Keywords:
+            rate sample rate of the signal.
+            length number of samples of the signal.
+            levels list of (bucket, mins, maxs, rms) tuples, from the finest
+                   to the coarsest level.
+            samples array of 16 bit samples of the signal (e.g. those of a
+                    memory-mapped PcmFile), used for the ranges finer than
+                    the finest level; if None those ranges have fewer
+                    points than pixels.
+        """
+        self.rate = rate
+        self.length = length
+        self.levels = levels
+        self.samples = samples
+
+    def duration(self):
+        """Return the duration of the signal in seconds.
+        """
+        return self.length / self.rate
+
+    def query(self, start, stop, width):
+        """Return the envelope of the given time range at the given width.
+
+        The coarsest level having at least one bucket per pixel is used;
+        below the finest level the samples are reduced instead, hence the
+        cost is proportional to the width.
+
+        Keywords:
+            start time of the beginning of the range, in seconds.
+            stop time of the end of the range, in seconds.
+            width number of output points.
+
+        Return:
+            Tuple containing the minimum, maximum and RMS arrays (fewer than
+            width points if the range has fewer samples than pixels, or
+            fewer buckets than pixels when the samples are not available).
+        """
+        start = max(0, int(start * self.rate))
+        stop = min(self.length, int(stop * self.rate))
+        if stop <= start or width <= 0:
+            return empty(0, float32), empty(0, float32), empty(0, float32)
+        if (self.samples is not None and
+                self.levels[0][0] * width > stop - start):
+            return self.exact(start, stop, width)
+
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate[0] * width <= stop - start:
+                level = candidate
+        bucket, mins, maxs, rms = level
+
+        first = start // bucket
+        last = min(len(mins), -(-stop // bucket))
+        count = last - first
+        width = min(width, count)
+        starts = linspace(first, last, width + 1)[:-1].astype(int)
+
+        power = rms[first:last] ** 2
+        return (minimum.reduceat(mins[first:last], starts - first),
+                maximum.reduceat(maxs[first:last], starts - first),
+                sqrt(add.reduceat(power, starts - first) /
+                     counts(starts - first, count)))
+
+    def exact(self, start, stop, width):
+        """Return the envelope of the given range of samples.
+
+        Keywords:
+            start index of the first sample.
+            stop index of the sample following the last one.
+            width number of output points.
+        """
+        data = self.samples[start:stop]
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        data = multiply(data, SCALE, dtype=float32)
+        width = min(width, len(data))
+        starts = linspace(0, len(data), width + 1)[:-1].astype(int)
+
+        return (minimum.reduceat(data, starts),
+                maximum.reduceat(data, starts),
+                sqrt(add.reduceat(data * data, starts) /
+                     counts(starts, len(data))))
+
+    def save(self, path):
+        """Save the overview to the given .npz file.
+        """
+        arrays = {}
+        for (bucket, mins, maxs, rms) in self.levels:
+            arrays['min{0}'.format(bucket)] = mins
+            arrays['max{0}'.format(bucket)] = maxs
+            arrays['rms{0}'.format(bucket)] = rms
+        with open(path, 'wb') as f:
+            savez(f, rate=self.rate, length=self.length,
+                  buckets=[level[0] for level in self.levels], **arrays)
+
+
+def counts(starts, total):
+    """Return the number of items reduced by reduceat for each start.
+    """
+    ends = concatenate((starts[1:], [total]))
+    return maximum(ends - starts, 1)
+
+def load_overview(path):
+    """Load the overview saved in the given .npz file.
+    """
+    data = load(path)
+    levels = []
+    for bucket in data['buckets']:
+        levels.append((int(bucket),
+                       data['min{0}'.format(bucket)],
+                       data['max{0}'.format(bucket)],
+                       data['rms{0}'.format(bucket)]))
+    return Overview(int(data['rate']), int(data['length']), levels)
+
+
+class Builder(object):
+    """Build an overview in a single streaming pass over a signal.
+
+    Only the finest level is computed while streaming; coarser levels are
+    derived from it when the overview is completed.
+    """
+
+    def __init__(self, rate=44100, buckets=BUCKETS):
+        """Constructor.
+
+        Keywords:
+            rate sample rate of the signal.
+            buckets number of samples of the buckets of each level (each
+                    one must be a multiple of the previous one).
+        """
+        self.rate = rate
+        self.buckets = buckets
+        self.bucket = buckets[0]
+        self.pending = empty(self.bucket, float32)
+        self.count = 0
+        self.length = 0
+        self.chunks = []
+
+    def push(self, data):
+        """Process the given samples.
+
+        Keywords:
+            data array of samples (multichannel frames are averaged).
+        """
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        self.length += len(data)
+
+        # complete the pending bucket first.
+        if self.count:
+            needed = min(self.bucket - self.count, len(data))
+            self.pending[self.count:self.count + needed] = data[:needed]
+            self.count += needed
+            data = data[needed:]
+            if self.count == self.bucket:
+                self.reduce(self.pending[None, :])
+                self.count = 0
+
+        full = len(data) // self.bucket * self.bucket
+        if full:
+            self.reduce(data[:full].reshape(-1, self.bucket))
+        rest = len(data) - full
+        if rest:
+            self.pending[:rest] = data[full:]
+            self.count = rest
+
+    def new_data_cb(self, source, data):
+        """Process the data emitted by a source.
+        """
+        self.push(data)
+
+    def reduce(self, rows):
+        """Compute the finest level values of the given buckets.
+        """
+        self.chunks.append((rows.min(axis=1), rows.max(axis=1),
+                            (rows * rows).mean(axis=1)))
+
+    def finish(self):
+        """Complete the overview.
+
+        Return:
+            Overview of the processed samples.
+        """
+        if self.count:
+            self.reduce(self.pending[None, :self.count])
+            self.count = 0
+        if not self.chunks:
+            self.chunks.append((empty(0, float32),) * 3)
+
+        mins = concatenate([chunk[0] for chunk in self.chunks])
+        maxs = concatenate([chunk[1] for chunk in self.chunks])
+        power = concatenate([chunk[2] for chunk in self.chunks])
+        self.chunks = []
+
+        levels = [(self.bucket, mins, maxs, sqrt(power))]
+        for bucket in self.buckets[1:]:
+            if not len(mins):
+                break
+            starts = arange(0, len(mins), bucket // levels[-1][0])
+            mins = minimum.reduceat(mins, starts)
+            maxs = maximum.reduceat(maxs, starts)
+            power = add.reduceat(power, starts) / counts(starts, len(power))
+            levels.append((bucket, mins, maxs, sqrt(power)))
+
+        return Overview(self.rate, self.length, levels)
+
+
+def overview(location, rebuild=False):
+    """Return the overview of the given audio file.
+
+    The overview is saved next to the file, and loaded from there while it
+    stays up to date. 16 bit WAV and raw PCM files are read directly, and
+    their samples are kept (memory-mapped) for the ranges finer than the
+    finest level; any other file (including WAV files in other formats) is
+    decoded offline by gstreamer.
+
+    Keywords:
+        location location of the audio file.
+        rebuild flag indicating wether to rebuild an up to date overview.
+    """
+    source = None
+    if os.path.splitext(location)[1].lower() in ('.wav', '.raw', '.pcm'):
+        try:
+            source = PcmFile(location)
+        except ValueError:
+            # WAV formats other than 16 bit PCM are decoded by gstreamer.
+            pass
+
+    path = location + '.overview.npz'
+    if (not rebuild and os.path.exists(path) and
+            os.path.getmtime(path) >= os.path.getmtime(location)):
+        result = load_overview(path)
+    elif source is not None:
+        builder = Builder(source.rate)
+        for i in xrange(0, len(source), 1 << 20):
+            builder.push(source.samples[i:i + (1 << 20)] * SCALE)
+        result = builder.finish()
+        result.save(path)
+    else:
+        # gstreamer is needed only to decode compressed files.
+        from audio.source import AudioFile
+        decoder = AudioFile(location, offline=True)
+        builder = Builder(44100)
+        decoder.connect('new-data', builder.new_data_cb)
+        decoder.run()
+        result = builder.finish()
+        result.save(path)
+
+    if source is not None:
+        result.samples = source.samples
+    return result
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing sources reading raw PCM and WAV files directly.
+
+Files are memory-mapped and parsed without gstreamer: data is read lazily
+by the operating system, and frames are views on the mapped file.
+"""
+
+from __future__ import division
+from struct import unpack
+from time import time
+import os
+
+import gobject
+from numpy import empty
+from numpy import float32
+from numpy import memmap
+from numpy import multiply
+from numpy.lib.stride_tricks import as_strided
+
+from audio.util import SCALE
+
+
+# wave format tags.
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+
+
+def parse_wave(location):
+    """Parse the header of the given WAV file.
+
+    Only 16 bit PCM data is supported.
+
+    Keywords:
+        location location of the WAV file.
+
+    Return:
+        Tuple containing the sample rate, the number of channels, the offset
+        and the size (in bytes) of the audio data.
+    """
+    with open(location, 'rb') as f:
+        riff, size, wave = unpack('<4sI4s', f.read(12))
+        if riff != 'RIFF' or wave != 'WAVE':
+            raise ValueError('Not a WAV file: {0}'.format(location))
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError('Missing data chunk: {0}'.format(location))
+            name, size = unpack('<4sI', header)
+            if name == 'fmt ':
+                fmt = f.read(size)
+                f.seek(size % 2, 1)
+            elif name == 'data':
+                break
+            else:
+                # chunks are aligned to 2 bytes.
+                f.seek(size + size % 2, 1)
+        offset = f.tell()
+
+    if fmt is None:
+        raise ValueError('Missing fmt chunk: {0}'.format(location))
+    tag, channels, rate, _, _, bits = unpack('<HHIIHH', fmt[:16])
+    if tag == WAVE_FORMAT_EXTENSIBLE:
+        tag, = unpack('<H', fmt[24:26])
+    if tag != WAVE_FORMAT_PCM or bits != 16:
+        raise ValueError('Unsupported WAV format: {0}'.format(location))
+
+    return rate, channels, offset, size
+
+
+class PcmFile(gobject.GObject):
+    """Memory-mapped 16 bit PCM (or WAV) file source object.
+
+    Emit the same 'new-data' signal of the other sources, paced in real time
+    by the main loop; frames can also be iterated directly, as fast as
+    possible, without any main loop.
+    """
+
+    __gsignals__ = {
+            'new-data': (gobject.SIGNAL_RUN_FIRST, None,
+                         (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, location, rate=44100, channels=1, blocksize=1024):
+        """Constructor.
+
+        WAV files are recognized by their header; any other file is read as
+        raw 16 bit signed little-endian data, using the given format.
+
+        Keywords:
+            location location of the file to read.
+            rate sample rate of raw files.
+            channels number of interleaved channels of raw files.
+            blocksize number of samples of the blocks emitted by the source.
+
+        Truncated files (e.g. interrupted captures) are read up to their
+        last whole sample, whatever the size declared by the header.
+        """
+        super(PcmFile, self).__init__()
+
+        with open(location, 'rb') as f:
+            wave = f.read(4) == 'RIFF'
+        if wave:
+            rate, channels, offset, size = parse_wave(location)
+        else:
+            offset = 0
+            size = None
+
+        available = os.path.getsize(location) - offset
+        if size is not None:
+            available = min(available, size)
+        count = max(0, available) // (2 * channels)
+
+        if count:
+            self.samples = memmap(location, dtype='<i2', mode='r',
+                                  offset=offset, shape=(count * channels,))
+        else:
+            # empty files cannot be mapped.
+            self.samples = empty(0, '<i2')
+        if channels > 1:
+            self.samples = self.samples.reshape(count, channels)
+
+        self.location = location
+        self.rate = rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.position = 0
+        self.started = None
+        self.timeout = None
+
+    def __len__(self):
+        """Return the number of samples (per channel) of the file.
+        """
+        return len(self.samples)
+
+    def duration(self):
+        """Return the duration of the file in seconds.
+        """
+        return len(self.samples) / self.rate
+
+    def seek(self, seconds):
+        """Move the current position to the given time.
+
+        Keywords:
+            seconds time from the beginning of the file.
+        """
+        self.seek_sample(int(seconds * self.rate))
+
+    def seek_sample(self, position):
+        """Move the current position to the given sample.
+
+        Keywords:
+            position index of the sample (per channel).
+        """
+        self.position = max(0, min(position, len(self.samples)))
+
+    def frames(self, size, hop=None, start=None, raw=False):
+        """Iterate over the frames of the file, from the given position.
+
+        Overlapping frames are strided views on the mapped file, and no data
+        is copied unless converted to floats; in that case each frame is
+        scaled in a buffer reused by the following frames. In both cases
+        frames are valid only until the next one is requested. Trailing
+        samples not filling a whole frame are ignored.
+
+        Keywords:
+            size number of samples of each frame.
+            hop number of samples between the start of consecutive frames
+                (defaults to size).
+            start index of the first sample (defaults to the current
+                  position).
+            raw flag indicating wether to yield the 16 bit integer samples
+                instead of floats bounded between -1 and 1.
+        """
+        hop = size if hop is None else hop
+        start = self.position if start is None else start
+        samples = self.samples[start:]
+        count = (len(samples) - size) // hop + 1
+        if count <= 0:
+            return
+
+        shape = (count, size) + samples.shape[1:]
+        strides = (hop * samples.strides[0],) + samples.strides
+        frames = as_strided(samples, shape=shape, strides=strides)
+        if raw:
+            for frame in frames:
+                yield frame
+            return
+
+        out = empty(shape[1:], float32)
+        for frame in frames:
+            yield multiply(frame, SCALE, out=out)
+
+    def blocks(self, start=None):
+        """Iterate over consecutive blocks of blocksize samples.
+
+        Keywords:
+            start index of the first sample (defaults to the current
+                  position).
+        """
+        return self.frames(self.blocksize, start=start)
+
+    def emit_blocks(self, count):
+        """Emit the given number of blocks from the current position.
+
+        Return:
+            False if the end of the file was reached, True otherwise.
+        """
+        blocks = self.blocks()
+        for _ in xrange(count):
+            block = next(blocks, None)
+            if block is None:
+                self.emit_rest()
+                return False
+            self.position += self.blocksize
+            self.emit('new-data', block)
+        return True
+
+    def emit_rest(self):
+        """Emit the trailing samples not filling a whole block, if any.
+        """
+        if self.position < len(self.samples):
+            rest = multiply(self.samples[self.position:], SCALE)
+            self.position = len(self.samples)
+            self.emit('new-data', rest)
+
+    def start(self):
+        """Start emitting data in real time from the current position.
+        """
+        if self.timeout is not None:
+            return
+        self.started = time(), self.position
+        interval = max(1, int(1000 * self.blocksize / self.rate))
+        self.timeout = gobject.timeout_add(interval, self.tick_cb)
+
+    def tick_cb(self):
+        """Emit the blocks due since the source was started.
+        """
+        started, position = self.started
+        due = position + int((time() - started) * self.rate)
+        count = (due - self.position) // self.blocksize
+        if count > 0 and not self.emit_blocks(count):
+            self.timeout = None
+            return False
+        return True
+
+    def pause(self):
+        """Stop emitting data, keeping the current position.
+        """
+        if self.timeout is not None:
+            gobject.source_remove(self.timeout)
+            self.timeout = None
+
+    def stop(self):
+        """Stop emitting data and rewind the file.
+        """
+        self.pause()
+        self.position = 0
+
+    def run(self):
+        """Emit all the remaining data as fast as possible.
+
+        Block the caller; no main loop is needed.
+        """
+        for block in self.blocks():
+            self.position += self.blocksize
+            self.emit('new-data', block)
+        self.emit_rest()
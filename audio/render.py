@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing functions used to render visualizations offline.
+
+Visualizers draw on offscreen cairo surfaces at a fixed frame rate, as fast
+as possible: the timeline is split in ranges of frames rendered by a pool
+of processes, and frames are written in order, either as a sequence of PNG
+images or as raw RGBA data (e.g. piped to a video encoder).
+"""
+
+from __future__ import division
+from argparse import ArgumentParser
+from inspect import getargspec
+from multiprocessing import Pool
+from tempfile import mkstemp
+from time import time
+import os
+import sys
+
+from numpy import frombuffer
+from numpy import multiply
+from numpy import uint8
+from numpy import zeros
+
+from audio.pcm import parse_wave
+from audio.pcm import PcmFile
+from audio.synth import pcm
+from audio.util import SCALE
+from audio.util import select
+from audio.visual import Analyzer
+from audio.visual import Oscilloscope
+
+
+# visualizers available to the renderer. The spectrogram is missing on
+# purpose: its history would depend on the frames rendered by the other
+# processes.
+VISUALIZERS = {
+        'analyzer': Analyzer,
+        'oscilloscope': Oscilloscope,
+}
+
+# output formats.
+FORMATS = ('png', 'rgba')
+
+
+def decoded(location):
+    """Return the location of a file readable as 16 bit PCM data.
+
+    16 bit WAV and raw PCM files are returned unchanged, any other file
+    (including WAV files in other formats) is decoded offline by gstreamer
+    into a temporary raw file (mono, 44100 Hz).
+
+    Return:
+        Tuple containing the location of the PCM data and a flag indicating
+        wether it is a temporary file.
+    """
+    extension = os.path.splitext(location)[1].lower()
+    if extension in ('.raw', '.pcm'):
+        return location, False
+    if extension == '.wav':
+        try:
+            parse_wave(location)
+            return location, False
+        except ValueError:
+            pass
+
+    # gstreamer is needed only to decode compressed files.
+    from audio.source import AudioFile
+    fd, path = mkstemp(suffix='.raw')
+    with os.fdopen(fd, 'wb') as f:
+        source = AudioFile(location, offline=True)
+        source.connect('new-data', lambda source, data: f.write(pcm(data)))
+        source.run()
+    return path, True
+
+def frame_count(samples, rate, fps):
+    """Return the number of video frames covering the given samples.
+    """
+    return -(-samples * fps // rate)
+
+def window(samples, position, size):
+    """Return the samples of the frame starting at the given position.
+
+    Frames past the end of the file are padded with silence.
+    """
+    chunk = samples[position:position + size]
+    out = zeros((size,) + samples.shape[1:], samples.dtype)
+    out[:len(chunk)] = chunk
+    return out
+
+def rgba(surface):
+    """Return the pixels of an ARGB32 cairo surface as RGBA bytes.
+    """
+    surface.flush()
+    width, height = surface.get_width(), surface.get_height()
+    data = frombuffer(surface.get_data(), uint8)
+    # cairo stores native-endian 32 bit pixels: BGRA on little-endian.
+    pixels = data.reshape(height, surface.get_stride())[:, :width * 4]
+    pixels = pixels.reshape(height, width, 4)
+    return pixels[..., (2, 1, 0, 3)].tostring()
+
+def render_range(location, first, last, visualizer='analyzer', width=640,
+                 height=360, fps=30, size=2048, output=None, **kwargs):
+    """Render the given range of frames.
+
+    Keywords:
+        location location of a WAV or raw PCM file.
+        first index of the first frame.
+        last index of the frame following the last one.
+        visualizer name of the visualizer (see VISUALIZERS).
+        width width of the frames in pixels.
+        height height of the frames in pixels.
+        fps number of frames per second of audio.
+        size number of samples displayed by each frame.
+        output pattern of the PNG files (e.g. 'frame%06d.png'), formatted
+               with the index of each frame; if None raw RGBA data is
+               returned instead.
+        kwargs keyword arguments of the visualizer.
+
+    Return:
+        String containing the RGBA data of the frames, in order (empty when
+        writing PNG files).
+    """
+    source = PcmFile(location)
+    factory = VISUALIZERS[visualizer]
+    if 'rate' in getargspec(factory.__init__).args:
+        kwargs['rate'] = source.rate
+    view = factory(**kwargs)
+    view.resize(width, height)
+
+    chunks = []
+    for index in xrange(first, last):
+        position = int(round(index * source.rate / fps))
+        samples = multiply(window(source.samples, position, size), SCALE)
+        view.data = select(samples, view.channel)
+        view.draw(view.context)
+        if output is None:
+            chunks.append(rgba(view.surface))
+        else:
+            view.surface.write_to_png(output % index)
+    return ''.join(chunks)
+
+def job(args):
+    """Render a range of frames; run by the processes of the pool.
+    """
+    location, first, last, kwargs = args
+    return render_range(location, first, last, **kwargs)
+
+def render(location, output, format='png', processes=None, chunk=30,
+           start=0, stop=None, **kwargs):
+    """Render the visualization of an audio file, in parallel.
+
+    Frames are rendered in ranges of chunk frames by a pool of processes;
+    raw data is written in frame order whatever the order of completion,
+    and each PNG file is named after the index of its frame, hence the
+    output does not depend on the number of processes.
+
+    Keywords:
+        location location of the audio file.
+        output pattern of the PNG files (see render_range) for the png
+               format, location of the output file or '-' (standard
+               output) for the rgba format.
+        format output format (see FORMATS).
+        processes number of processes of the pool (defaults to the number
+                  of cores).
+        chunk number of frames rendered by each job.
+        start time of the first frame, in seconds.
+        stop time of the end of the rendering, in seconds (defaults to the
+             end of the file).
+        kwargs keyword arguments of render_range (visualizer, width,
+               height, fps, size and the options of the visualizer).
+
+    Return:
+        Number of rendered frames.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format: {0}'.format(format))
+
+    path, temporary = decoded(location)
+    try:
+        source = PcmFile(path)
+        fps = kwargs.get('fps', 30)
+        count = frame_count(len(source), source.rate, fps)
+        first = int(start * fps)
+        last = count if stop is None else min(count, int(stop * fps))
+        if format == 'png':
+            kwargs['output'] = output
+
+        ranges = [(path, i, min(i + chunk, last), kwargs)
+                  for i in xrange(first, last, chunk)]
+        if not ranges:
+            return 0
+
+        pool = Pool(processes)
+        # imap returns the results in submission order.
+        results = pool.imap(job, ranges)
+        pool.close()
+        if format == 'rgba':
+            f = sys.stdout if output == '-' else open(output, 'wb')
+            try:
+                for data in results:
+                    f.write(data)
+            finally:
+                if f is not sys.stdout:
+                    f.close()
+        else:
+            for _ in results:
+                pass
+        pool.join()
+    finally:
+        if temporary:
+            os.remove(path)
+
+    return last - first
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0],
+                            description='Render visualizations offline.')
+    parser.add_argument('location', help='audio file to visualize')
+    parser.add_argument('output',
+                        help="pattern of the PNG files (e.g. "
+                             "'frames/%%06d.png'), or output file of the "
+                             "raw RGBA data ('-' for stdout)")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='png')
+    parser.add_argument('-v', '--visualizer', choices=sorted(VISUALIZERS),
+                        default='analyzer')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of parallel processes')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--size', type=int, default=2048,
+                        help='number of samples displayed by each frame')
+    parser.add_argument('--start', type=float, default=0,
+                        help='time of the first frame in seconds')
+    parser.add_argument('--stop', type=float, default=None,
+                        help='time of the end in seconds')
+    parser.add_argument('--fill', action='store_true',
+                        help='fill the envelope of the oscilloscope')
+    args = parser.parse_args(argv[1:])
+
+    kwargs = {}
+    if args.visualizer == 'oscilloscope':
+        kwargs['fill'] = args.fill
+    begin = time()
+    frames = render(args.location, args.output, args.format, args.processes,
+                    start=args.start, stop=args.stop,
+                    visualizer=args.visualizer, width=args.width,
+                    height=args.height, fps=args.fps, size=args.size,
+                    **kwargs)
+    elapsed = time() - begin
+
+    # the standard output could be receiving the frames.
+    seconds = frames / args.fps
+    sys.stderr.write('{0} frames ({1:.1f}s of video) in {2:.1f}s '
+                     '({3:.1f}x)\n'.format(frames, seconds, elapsed,
+                                           seconds / max(elapsed, 1e-6)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing the publication of audio frames to local processes.
+
+A publisher attached to a source writes fixed size frames (and optionally
+their spectrums) into a ring of slots in a shared memory file; any number
+of subscribers map the same file and read the frames as numpy views,
+without copies, each one at its own pace.
+
+Each published frame has a sequence number: slots store it before and
+after their data, and the header stores the sequence number of the last
+complete frame. Subscribers falling more than a ring behind skip the
+overwritten frames and count them as overruns; a frame overwritten while
+being consumed is counted as well.
+"""
+
+from __future__ import division
+import mmap
+import os
+import tempfile
+
+import gobject
+from numpy import dtype
+from numpy import frombuffer
+from numpy import ndarray
+from numpy import uint64
+
+from audio.util import FFT
+from audio.util import RingBuffer
+
+
+# identifier of the shared memory files.
+MAGIC = frombuffer('AUDIOSHM', uint64)[0]
+
+# header fields (64 bit each): magic, number of slots, samples per frame,
+# channels, spectrum bins per channel, sample rate, last sequence number.
+HEADER = ('magic', 'slots', 'size', 'channels', 'bins', 'rate', 'head')
+HEADER_SIZE = 64
+
+
+def location(name):
+    """Return the location of the shared memory file with the given name.
+
+    Files are created in /dev/shm when available (memory backed), in the
+    temporary directory otherwise.
+    """
+    directory = '/dev/shm'
+    if not os.path.isdir(directory):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, 'audio-{0}'.format(name))
+
+def layout(size, channels, bins):
+    """Return the type of the slots of the ring.
+
+    Keywords:
+        size number of samples of each frame.
+        channels number of channels of each sample.
+        bins number of spectrum bins of each channel (0 for no spectrums).
+    """
+    return dtype([('begin', '<u8'),
+                  ('data', '<f4', (size * channels,)),
+                  ('spectrum', '<f4', (channels * bins,)),
+                  ('end', '<u8')])
+
+
+class Publisher(object):
+    """Publish the data emitted by a source into a shared memory ring.
+    """
+
+    def __init__(self, source, name, slots=64, size=2048, hop=None,
+                 spectrum=False, window='hann', rate=44100):
+        """Constructor.
+
+        Keywords:
+            source audio source emitting new data.
+            name name of the shared memory file (see location).
+            slots number of frames kept by the ring.
+            size number of samples of each published frame.
+            hop number of samples between the start of consecutive frames
+                (defaults to size).
+            spectrum flag indicating wether to publish the spectrum (in dB)
+                     of each frame, one per channel.
+            window name of the window function applied before the fft.
+            rate sample rate of the input audio signal.
+        """
+        hop = size if hop is None else hop
+        channels = getattr(source, 'channels', 1)
+        self.engine = FFT(window) if spectrum else None
+        bins = self.engine.plan(size).bins if spectrum else 0
+
+        self.path = location(name)
+        self.type = layout(size, channels, bins)
+        length = HEADER_SIZE + slots * self.type.itemsize
+        with open(self.path, 'w+b') as f:
+            f.truncate(length)
+            self.map = mmap.mmap(f.fileno(), length)
+
+        self.header = ndarray(len(HEADER), uint64, buffer=self.map)
+        self.slots = ndarray(slots, self.type, buffer=self.map,
+                             offset=HEADER_SIZE)
+        self.header[:] = (MAGIC, slots, size, channels, bins, rate, 0)
+        self.channels = channels
+        self.sequence = 0
+
+        self.ring = RingBuffer(size, hop, channels=channels)
+        self.handler = source.connect('new-data', self.new_data_cb)
+        self.source = source
+
+    def new_data_cb(self, source, data):
+        """Publish the frames completed by the new data.
+        """
+        for frame in self.ring.push(data):
+            self.publish(frame)
+
+    def publish(self, frame):
+        """Write the given frame into the next slot of the ring.
+
+        The slot is marked with the new sequence number before its data is
+        written and after, and only then the header is updated: readers
+        never see the new sequence number before the frame is complete.
+        """
+        self.sequence += 1
+        slot = self.slots[self.sequence % len(self.slots)]
+        slot['begin'] = self.sequence
+        slot['data'] = frame.reshape(-1)
+        if self.engine is not None:
+            spectrum = self.engine.decibel(frame.T)
+            slot['spectrum'] = spectrum.reshape(-1)
+        slot['end'] = self.sequence
+        self.header[-1] = self.sequence
+
+    def close(self):
+        """Stop publishing and remove the shared memory file.
+        """
+        self.source.disconnect(self.handler)
+        del self.header, self.slots
+        self.map.close()
+        os.remove(self.path)
+
+
+class Subscriber(gobject.GObject):
+    """Read the frames published into a shared memory ring.
+
+    When started, the subscriber polls the ring from the main loop and
+    emits the same 'new-data' signal of the other sources, hence it can
+    feed visualizers, framers and workers.
+    """
+
+    __gsignals__ = {
+            'new-data': (gobject.SIGNAL_RUN_FIRST, None,
+                         (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, name, spectrum=False, interval=10):
+        """Constructor.
+
+        Keywords:
+            name name of the shared memory file (see location).
+            spectrum flag indicating wether to emit the published spectrums
+                     instead of the frames (e.g. for an Analyzer created
+                     with spectrum=True).
+            interval number of milliseconds between polls.
+        """
+        super(Subscriber, self).__init__()
+
+        self.path = location(name)
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = frombuffer(self.map, uint64, len(HEADER))
+        magic, slots, size, channels, bins, rate, _ = self.header.tolist()
+        if magic != MAGIC:
+            raise ValueError('Not an audio ring: {0}'.format(self.path))
+        if spectrum and not bins:
+            raise ValueError('Spectrums not published: {0}'.format(name))
+
+        self.slots = ndarray(slots, layout(size, channels, bins),
+                             buffer=self.map, offset=HEADER_SIZE)
+        self.size = size
+        self.channels = channels
+        self.bins = bins
+        self.rate = rate
+        self.spectrum = spectrum
+        self.interval = interval
+        self.timeout = None
+        # start from the next published frame.
+        self.position = int(self.header[-1]) + 1
+        self.overruns = 0
+
+    def read(self):
+        """Return the next published frame, if any.
+
+        Frames overwritten before being read are skipped and counted as
+        overruns. The returned arrays are views on the shared memory: the
+        publisher could overwrite them at any time, see valid.
+
+        Return:
+            Tuple containing the sequence number, the frame (with shape
+            (size, channels) for multichannel data) and the spectrum (with
+            shape (channels, bins) for multichannel data, None if not
+            published), or None if no new frame was published.
+        """
+        head = int(self.header[-1])
+        if head < self.position:
+            return None
+        oldest = head - len(self.slots) + 1
+        if self.position < oldest:
+            self.overruns += oldest - self.position
+            self.position = oldest
+
+        sequence = self.position
+        slot = self.slots[sequence % len(self.slots)]
+        if slot['end'] != sequence:
+            # overwritten in the meantime.
+            self.overruns += 1
+            self.position += 1
+            return None
+        self.position += 1
+
+        data = slot['data']
+        spectrum = slot['spectrum'] if self.bins else None
+        if self.channels > 1:
+            data = data.reshape(self.size, self.channels)
+            if spectrum is not None:
+                spectrum = spectrum.reshape(self.channels, self.bins)
+        return sequence, data, spectrum
+
+    def valid(self, sequence):
+        """Check wether the frame with the given sequence number is intact.
+
+        Consumers of the views returned by read can invoke it after their
+        processing, to discard results computed on overwritten data.
+        """
+        slot = self.slots[sequence % len(self.slots)]
+        return slot['begin'] == sequence
+
+    def poll_cb(self):
+        """Emit the frames published since the last poll.
+        """
+        while True:
+            item = self.read()
+            if item is None:
+                if int(self.header[-1]) < self.position:
+                    break
+                continue
+            sequence, data, spectrum = item
+            self.emit('new-data', spectrum if self.spectrum else data)
+            if not self.valid(sequence):
+                self.overruns += 1
+        return True
+
+    def start(self):
+        """Start polling the ring from the main loop.
+
+        Frames published while the subscriber was not polling are skipped.
+        """
+        if self.timeout is None:
+            self.position = int(self.header[-1]) + 1
+            self.timeout = gobject.timeout_add(self.interval, self.poll_cb)
+
+    def pause(self):
+        """Stop polling the ring.
+        """
+        if self.timeout is not None:
+            gobject.source_remove(self.timeout)
+            self.timeout = None
+
+    def stop(self):
+        """Stop polling the ring.
+        """
+        self.pause()
+
+    def close(self):
+        """Stop polling and unmap the shared memory file.
+        """
+        self.stop()
+        del self.header, self.slots
+        self.map.close()
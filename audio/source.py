@@ -5,10 +5,72 @@
 """
 
 from __future__ import division
-from struct import unpack
+from threading import Event
+from threading import Semaphore
+from time import time
 
 import gobject
 import gst
+from numpy import empty
+from numpy import float32
+
+from audio import stats
+from audio.stats import Histogram
+from audio.synth import pcm
+from audio.synth import Synth
+from audio.util import decode
+from audio.util import RingBuffer
+
+
+# latency profiles (see Source.set_latency):
+#     blocksize number of samples of each buffer produced by the source.
+#     latency_time duration of a segment of the audio devices, in
+#                  microseconds.
+#     buffer_time total duration buffered by the audio devices, in
+#                 microseconds.
+#     max_size_time maximum duration of the data held by the queues, in
+#                   nanoseconds.
+# smaller values lower the latency, at the cost of more wakeups per second.
+PROFILES = {
+        'low': {
+            'blocksize': 256,
+            'latency_time': 5000,
+            'buffer_time': 20000,
+            'max_size_time': 10 * gst.MSECOND,
+        },
+        'balanced': {
+            'blocksize': 1024,
+            'latency_time': 20000,
+            'buffer_time': 100000,
+            'max_size_time': 50 * gst.MSECOND,
+        },
+        'powersave': {
+            'blocksize': 4096,
+            'latency_time': 100000,
+            'buffer_time': 400000,
+            'max_size_time': 200 * gst.MSECOND,
+        },
+}
+
+
+def configure(element, name, value):
+    """Set the given property of the element, if it has one.
+
+    Return:
+        True if the property was set, False otherwise.
+    """
+    if element is None or value is None:
+        return False
+    if name not in [spec.name for spec in gobject.list_properties(element)]:
+        return False
+    element.set_property(name, value)
+    return True
+
+def failure(message):
+    """Return the exception describing the given error message of a bus.
+    """
+    error, debug = message.parse_error()
+    return RuntimeError('{0} ({1})'.format(error.message, debug))
 
 
 class Source(gobject.GObject):
@@ -20,49 +82,121 @@ class Source(gobject.GObject):
                          (gobject.TYPE_PYOBJECT,)),
     }
 
-    def __init__(self, pipeline, speakers, emit):
+    def __init__(self, pipeline, speakers, emit, aslist=False, channels=1,
+                 rate=44100):
         """Constructor.
 
         Keywords:
             pipeline string representing a gstreamer pipeline.
             speakers flag indicating wether to output data to the speakers.
             emit flag indicating wether to emit signals notifying new data.
+            aslist flag indicating wether to emit data as lists instead of
+                   arrays (kept for old consumers).
+            channels number of channels produced by the pipeline.
+            rate sample rate produced by the pipeline.
         """
         super(Source, self).__init__()
 
+        self.aslist = aslist
+        self.channels = channels
+        self.rate = rate
+        self.caps = None
+        self.supported = False
+        self.buffer = empty(0, float32)
+
         self.pipeline = gst.parse_launch(pipeline)
-        if not speakers:
-            self.pipeline.get_by_name('asink').set_state(gst.STATE_NULL)
+        asink = self.pipeline.get_by_name('asink')
+        if not speakers and asink is not None:
+            asink.set_state(gst.STATE_NULL)
         if emit:
             self.pipeline.get_by_name('fsink').connect('handoff',
                                                        self.handoff_cb)
 
+    def check_caps(self, caps):
+        """Check wether the given caps match the supported format.
+
+        Keywords:
+            caps gstreamer caps to check.
+
+        Return:
+            True if the caps are supported, False otherwise.
+        """
+        for item in caps:
+            try:
+                if not (item['endianness'] == 1234 and
+                        item['signed'] == True and
+                        item['width'] == 16 and item['depth'] == 16 and
+                        item['rate'] == self.rate and
+                        item['channels'] == self.channels):
+                    return False
+            except KeyError:
+                return False
+        return True
+
+    def decode(self, buff):
+        """Decode the given buffer into the array reused by the source.
+
+        The caps are validated only when they change.
+
+        Return:
+            Array of values bounded between -1 and 1, with shape (frames,
+            channels) for multichannel data, or None if the caps of the
+            buffer are not supported.
+        """
+        caps = buff.caps
+        if self.caps is None or not caps.is_equal(self.caps):
+            self.caps = caps
+            self.supported = self.check_caps(caps)
+            if not self.supported:
+                print 'Caps not supported:', caps
+        if not self.supported:
+            return None
+
+        samples = buff.size // 2 # 16 bits per sample
+        if len(self.buffer) < samples:
+            self.buffer = empty(samples, float32)
+
+        data = decode(buff.data, self.buffer[:samples])
+        if self.channels > 1:
+            data = data.reshape(-1, self.channels)
+        return data
+
     def handoff_cb(self, fakesink, buff, pad):
         """Invoked when the fakesink collected a new buffer of data.
 
         The format of the input buffer is supposed to be:
-            channels: mono
-            samplerate: 44100
+            channels: as configured (interleaved)
+            samplerate: as configured
             bitspersample: 16 signed
             endianess: little
 
         Emit a signal containing the array of data: the values are bounded
-        between -1 and 1
+        between -1 and 1. Multichannel data is emitted as a (frames,
+        channels) view of the decoded samples. The emitted array is reused
+        by the next buffers, hence consumers willing to keep the data have to
+        copy it.
         """
-        for item in buff.caps:
-            try:
-                if (item['endianness'] == 1234 and item['signed'] == True and
-                    item['width'] == 16 and item['depth'] == 16 and
-                    item['rate'] == 44100 and item['channels'] == 1):
-                    continue
-            except KeyError:
-                print 'Caps not supported:', buff.caps
-                return
-
-        samples = buff.size // 2 # 16 bits per sample
-
-        fmt = "<" + str(samples) + "h"
-        self.emit('new-data', [v / 32768 for v in unpack(fmt, buff.data)])
+        instrument = stats.ENABLED
+        if instrument:
+            arrival = time()
+            stats.count('buffers')
+
+        data = self.decode(buff)
+        if data is None:
+            if instrument:
+                stats.count('caps-rejected')
+            return
+
+        if self.aslist:
+            data = data.tolist()
+
+        if instrument:
+            stats.record('decode', time() - arrival)
+            stats.gauge('timestamp', buff.timestamp / gst.SECOND)
+            stats.stamp(buff.timestamp, arrival)
+        self.emit('new-data', data)
+        if instrument:
+            stats.record('handoff', time() - arrival)
 
     def start(self):
         """Start the pipeline.
@@ -79,6 +213,180 @@ class Source(gobject.GObject):
         """
         self.pipeline.set_state(gst.STATE_READY)
 
+    def run(self):
+        """Play the pipeline until the end of the stream, then stop it.
+
+        Block the caller: new data is emitted from the streaming thread,
+        hence no main loop is needed.
+        """
+        bus = self.pipeline.get_bus()
+        self.pipeline.set_state(gst.STATE_PLAYING)
+        message = bus.poll(gst.MESSAGE_EOS | gst.MESSAGE_ERROR, -1)
+        self.pipeline.set_state(gst.STATE_NULL)
+        if message.type == gst.MESSAGE_ERROR:
+            raise failure(message)
+
+    def appsink(self, max_buffers):
+        """Replace the fakesink of the pipeline with an appsink.
+
+        Data is then pulled from the appsink instead of being emitted from
+        the streaming thread; the pipeline must be stopped.
+
+        Keywords:
+            max_buffers maximum number of buffers queued by the appsink:
+                        when full, upstream elements wait for the consumer.
+
+        Return:
+            The appsink element.
+        """
+        sink = self.pipeline.get_by_name('psink')
+        if sink is None:
+            fsink = self.pipeline.get_by_name('fsink')
+            peer = fsink.get_pad('sink').get_peer().get_parent_element()
+            sink = gst.element_factory_make('appsink', 'psink')
+            sink.set_property('sync', fsink.get_property('sync'))
+            peer.unlink(fsink)
+            self.pipeline.remove(fsink)
+            self.pipeline.add(sink)
+            peer.link(sink)
+        sink.set_property('max-buffers', max_buffers)
+        sink.set_property('drop', False)
+        return sink
+
+    def iter_frames(self, size=2048, hop=512, max_buffers=8, block=True):
+        """Play the pipeline and iterate over fixed size frames of data.
+
+        Buffers are pulled from an appsink (see Source.appsink), hence no
+        main loop nor signal emission is involved, and at most max_buffers
+        buffers wait for the consumer. The pipeline is stopped when the
+        stream ends (the trailing partial frame is discarded) or when the
+        iteration is abandoned.
+
+        Non-blocking iteration yields None whenever no buffer is ready:
+        consumers driven by an event loop can iterate from its callbacks
+        without stalling it.
+
+        Pipeline errors (e.g. a missing or undecodable file) end the
+        iteration with the RuntimeError raised by run, even when no data
+        ever flows.
+
+        Keywords:
+            size number of samples of each frame.
+            hop number of samples between the start of consecutive frames.
+            max_buffers maximum number of buffers waiting to be consumed.
+            block flag indicating wether to wait for the next buffer.
+
+        Return:
+            Generator of frames of values bounded between -1 and 1, with
+            shape (size, channels) for multichannel data. Frames are views
+            on a preallocated buffer, valid until the next iteration.
+        """
+        sink = self.appsink(max_buffers)
+        ring = RingBuffer(size, hop, channels=self.channels)
+        # released once for each new buffer, at the end of the stream and
+        # on errors: the end of the stream is never reached when the
+        # pipeline fails before any data flows.
+        ready = Semaphore(0)
+        errors = []
+
+        def wakeup_cb(appsink):
+            ready.release()
+
+        def error_cb(bus, message):
+            errors.append(message)
+            ready.release()
+
+        sink.set_property('emit-signals', True)
+        handlers = [sink.connect('new-buffer', wakeup_cb),
+                    sink.connect('eos', wakeup_cb)]
+        bus = self.pipeline.get_bus()
+        bus.enable_sync_message_emission()
+        bus_handler = bus.connect('sync-message::error', error_cb)
+        try:
+            if self.pipeline.set_state(gst.STATE_PLAYING) == \
+                    gst.STATE_CHANGE_FAILURE:
+                message = bus.poll(gst.MESSAGE_ERROR, 0)
+                if message is not None:
+                    raise failure(message)
+                raise RuntimeError('Unable to play the pipeline')
+
+            while True:
+                if not ready.acquire(block):
+                    yield None
+                    continue
+                if errors:
+                    raise failure(errors[0])
+                buff = sink.emit('pull-buffer')
+                if buff is None:
+                    break
+                data = self.decode(buff)
+                if data is None:
+                    continue
+                for frame in ring.push(data):
+                    yield frame
+        finally:
+            for handler in handlers:
+                sink.disconnect(handler)
+            bus.disconnect(bus_handler)
+            bus.disable_sync_message_emission()
+            self.pipeline.set_state(gst.STATE_NULL)
+
+    def set_latency(self, profile=None, blocksize=None, latency_time=None,
+                    buffer_time=None, max_size_time=None):
+        """Configure the buffering of the pipeline.
+
+        Buffering trades CPU wakeups against responsiveness: the settings
+        of the source, of the queues and of the audio sink are configured
+        together, hence the pipeline must be stopped. Explicit keywords
+        override the values of the profile; unset values keep the defaults
+        of the pipeline, and properties missing on the elements are
+        skipped.
+
+        Keywords:
+            profile name of a latency profile (see PROFILES).
+            blocksize number of samples of each buffer of the source.
+            latency_time duration of a device segment, in microseconds.
+            buffer_time total duration buffered by the devices, in
+                        microseconds.
+            max_size_time maximum duration held by the queues, in
+                          nanoseconds.
+        """
+        settings = dict(PROFILES[profile]) if profile is not None else {}
+        for (key, value) in (('blocksize', blocksize),
+                             ('latency_time', latency_time),
+                             ('buffer_time', buffer_time),
+                             ('max_size_time', max_size_time)):
+            if value is not None:
+                settings[key] = value
+
+        blocksize = settings.get('blocksize')
+        source = self.pipeline.get_by_name('source')
+        if not configure(source, 'samplesperbuffer', blocksize):
+            if blocksize is not None:
+                # base sources count bytes: 16 bits per sample.
+                blocksize *= 2 * self.channels
+            configure(source, 'blocksize', blocksize)
+        for name in ('source', 'asink'):
+            element = self.pipeline.get_by_name(name)
+            configure(element, 'latency-time', settings.get('latency_time'))
+            configure(element, 'buffer-time', settings.get('buffer_time'))
+        for name in ('fqueue', 'aqueue'):
+            configure(self.pipeline.get_by_name(name), 'max-size-time',
+                      settings.get('max_size_time'))
+
+    def latency(self):
+        """Query the latency negotiated by the running pipeline.
+
+        Return:
+            Tuple containing a flag indicating wether the pipeline is live,
+            and the minimum and maximum latency in nanoseconds; None if the
+            query failed (e.g. the pipeline is not playing).
+        """
+        query = gst.query_new_latency()
+        if not self.pipeline.query(query):
+            return None
+        return query.parse_latency()
+
     def set_delay(self, delay):
         """Set output delay to the given amount of time.
 
@@ -88,58 +396,122 @@ class Source(gobject.GObject):
         self.pipeline.get_by_name('asink').set_property('ts-offset', delay)
 
 
+def measure_latency(profile=None, buffers=100, timeout=10, **settings):
+    """Measure the in-process loop latency of the given buffering settings.
+
+    A live test source feeds a synchronized fake sink, standing in for the
+    capture device and the consumers: the latency of each buffer is the
+    clock time of its handoff minus its running time, hence it includes
+    the duration of the buffer and the queuing.
+
+    Keywords:
+        profile name of a latency profile (see PROFILES).
+        buffers number of measured buffers.
+        timeout maximum number of seconds to wait for the buffers.
+        settings keywords overriding the profile (see Source.set_latency).
+
+    Return:
+        Dictionary containing the summary of the measured latencies, in
+        seconds (see stats.Histogram), and the latency negotiated by the
+        pipeline.
+    """
+    source = Source(
+        '''audiotestsrc name=source is-live=true !
+           audio/x-raw-int,
+                   channels=1,
+                   rate=44100,
+                   width=16,
+                   signed=true,
+                   endianness=1234 !
+           queue name=fqueue max-size-time=1000 !
+               fakesink name=fsink signal-handoffs=true sync=true''',
+        False, False)
+    source.set_latency(profile, **settings)
+
+    pipeline = source.pipeline
+    histogram = Histogram()
+    done = Event()
+
+    def handoff_cb(fakesink, buff, pad):
+        clock = pipeline.get_clock()
+        if clock is None or histogram.count >= buffers:
+            return
+        running = buff.timestamp + pipeline.get_base_time()
+        histogram.add((clock.get_time() - running) / gst.SECOND)
+        if histogram.count == buffers:
+            done.set()
+
+    pipeline.get_by_name('fsink').connect('handoff', handoff_cb)
+    source.start()
+    try:
+        done.wait(timeout)
+        negotiated = source.latency()
+    finally:
+        pipeline.set_state(gst.STATE_NULL)
+
+    result = histogram.summary()
+    result['negotiated'] = negotiated
+    return result
+
+
 class Microphone(Source):
     """Microphone source object.
     """
 
-    def __init__(self, speakers=True, emit=False):
+    def __init__(self, speakers=True, emit=False, aslist=False, channels=1):
         """Constructor.
 
         Keywords:
             speakers flag indicating wether to output data to the speakers.
             emit flag indicating wether to emit signals notifying new data.
+            aslist flag indicating wether to emit data as lists.
+            channels number of captured channels.
         """
         super(Microphone, self).__init__(
             '''pulsesrc name=source !
                audioconvert !
                audio/x-raw-int,
-                       channels=1,
+                       channels={0},
                        rate=44100,
                        width=16,
                        signed=true,
                        endianness=1234 !
                tee name=t !
-               queue max-size-time=1000 !
+               queue name=fqueue max-size-time=1000 !
                    fakesink name=fsink signal-handoffs=true sync=true t. !
-               queue max-size-time=1000 !
-                   pulsesink name=asink''', speakers, emit)
+               queue name=aqueue max-size-time=1000 !
+                   pulsesink name=asink'''.format(channels),
+            speakers, emit, aslist, channels)
 
 
 class Tone(Source):
     """Single tone source object.
     """
 
-    def __init__(self, speakers=True, emit=False):
+    def __init__(self, speakers=True, emit=False, aslist=False, channels=1):
         """Constructor.
 
         Keywords:
             speakers flag indicating wether to output data to the speakers.
             emit flag indicating wether to emit signals notifying new data.
+            aslist flag indicating wether to emit data as lists.
+            channels number of generated channels.
         """
         super(Tone, self).__init__(
             '''audiotestsrc name=source !
                audioconvert !
                audio/x-raw-int,
-                       channels=1,
+                       channels={0},
                        rate=44100,
                        width=16,
                        signed=true,
                        endianness=1234 !
                tee name=t !
-               queue max-size-time=1000 !
+               queue name=fqueue max-size-time=1000 !
                    fakesink name=fsink signal-handoffs=true sync=true t. !
-               queue max-size-time=1000 !
-                   pulsesink name=asink''', speakers, emit)
+               queue name=aqueue max-size-time=1000 !
+                   pulsesink name=asink'''.format(channels),
+            speakers, emit, aslist, channels)
 
     def set_values(self, freq, volume):
         """Set source properties.
@@ -153,31 +525,197 @@ class Tone(Source):
         source.set_property('volume', 1 * (volume + 1) / 2)
 
 
+class Synthesizer(Source):
+    """Synthesizer source object.
+
+    Blocks are generated by a Synth and pushed into the pipeline through an
+    appsrc: changing frequency or volume just sets the targets the next
+    block ramps to.
+    """
+
+    def __init__(self, speakers=True, emit=False, aslist=False, voices=1,
+                 waveform='sine', blocksize=1024):
+        """Constructor.
+
+        Keywords:
+            speakers flag indicating wether to output data to the speakers.
+            emit flag indicating wether to emit signals notifying new data.
+            aslist flag indicating wether to emit data as lists.
+            voices number of oscillators of the synthesizer.
+            waveform initial waveform of the oscillators.
+            blocksize number of samples of each generated block.
+        """
+        super(Synthesizer, self).__init__(
+            '''appsrc name=source !
+               audioconvert !
+               audio/x-raw-int,
+                       channels=1,
+                       rate=44100,
+                       width=16,
+                       signed=true,
+                       endianness=1234 !
+               tee name=t !
+               queue name=fqueue max-size-time=1000 !
+                   fakesink name=fsink signal-handoffs=true sync=true t. !
+               queue name=aqueue max-size-time=1000 !
+                   pulsesink name=asink''', speakers, emit, aslist)
+
+        self.synth = Synth(voices, waveform, 44100, blocksize)
+        self.offset = 0
+
+        source = self.pipeline.get_by_name('source')
+        source.set_property('caps', gst.Caps('''audio/x-raw-int,
+                                                channels=1,
+                                                rate=44100,
+                                                width=16,
+                                                depth=16,
+                                                signed=true,
+                                                endianness=1234'''))
+        source.set_property('format', gst.FORMAT_TIME)
+        source.connect('need-data', self.need_data_cb)
+
+    def need_data_cb(self, appsrc, length):
+        """Push the next block generated by the synthesizer.
+        """
+        blocksize = self.synth.blocksize
+        buff = gst.Buffer(pcm(self.synth.block()))
+        buff.timestamp = self.offset * gst.SECOND // 44100
+        buff.duration = blocksize * gst.SECOND // 44100
+        self.offset += blocksize
+        appsrc.emit('push-buffer', buff)
+
+    def set_latency(self, profile=None, blocksize=None, **settings):
+        """Configure the buffering of the pipeline (see Source.set_latency).
+
+        The appsrc pushes the blocks it is given, whatever its blocksize
+        property: the blocks generated by the synthesizer are resized
+        instead.
+        """
+        if blocksize is None and profile is not None:
+            blocksize = PROFILES[profile]['blocksize']
+        if blocksize is not None:
+            self.synth.resize(blocksize)
+        super(Synthesizer, self).set_latency(profile, blocksize, **settings)
+
+    def pause(self):
+        """Pause the pipeline.
+
+        The READY state resets the segment and the base time of the
+        pipeline, hence timestamps restart from zero.
+        """
+        super(Synthesizer, self).pause()
+        self.offset = 0
+
+    def stop(self):
+        """Stop the pipeline.
+        """
+        super(Synthesizer, self).stop()
+        self.offset = 0
+
+    def set_values(self, freq, volume):
+        """Set source properties.
+
+        Keywords:
+            freq new frequency value bounded between -1 and +1.
+            volume new volume value bounded between -1 and +1.
+        """
+        self.synth.set_voice(0, 20000 * (freq + 1) / 2, (volume + 1) / 2)
+
+
 class AudioFile(Source):
     """Audio file source object.
     """
 
-    def __init__(self, location, speakers=True, emit=False):
+    def __init__(self, location, speakers=True, emit=False, aslist=False,
+                 offline=False, channels=1, rate=44100):
         """Constructor.
 
+        In offline mode the pipeline has no audio sink and is not
+        synchronized to the clock: data is decoded and emitted as fast as
+        possible (see Source.run).
+
         Keywords:
             location location of the file to play
             speakers flag indicating wether to output data to the speakers.
             emit flag indicating wether to emit signals notifying new data.
+            aslist flag indicating wether to emit data as lists.
+            offline flag indicating wether to decode the file offline.
+            channels number of decoded channels.
+            rate sample rate of the decoded data.
         """
-        super(AudioFile, self).__init__(
-            '''filesrc location="{0}" !
+        if offline:
+            pipeline = '''filesrc location="{0}" !
                decodebin !
                audioconvert !
                audio/x-raw-int,
-                       channels=1,
-                       rate=44100,
+                       channels={1},
+                       rate={2},
+                       width=16,
+                       signed=true,
+                       endianness=1234 !
+               fakesink name=fsink signal-handoffs=true sync=false'''
+        else:
+            pipeline = '''filesrc location="{0}" !
+               decodebin !
+               audioconvert !
+               audio/x-raw-int,
+                       channels={1},
+                       rate={2},
                        width=16,
                        signed=true,
                        endianness=1234 !
                tee name=t !
-               queue max-size-time=1000 !
+               queue name=fqueue max-size-time=1000 !
                    fakesink name=fsink signal-handoffs=true sync=true t. !
-               queue max-size-time=1000 !
-                   pulsesink name=asink'''.format(location),
-            speakers, emit)
+               queue name=aqueue max-size-time=1000 !
+                   pulsesink name=asink'''
+        super(AudioFile, self).__init__(
+                pipeline.format(location, channels, rate),
+                speakers and not offline, emit or offline, aslist, channels,
+                rate)
+
+
+class Framer(gobject.GObject):
+    """Split the data emitted by a source into fixed size frames.
+
+    Frames have a constant size, hence visualizers and analysis code obtain
+    a stable frequency resolution whatever the size of the buffers produced
+    by gstreamer; the hop controls the overlap between consecutive frames,
+    trading latency for CPU.
+    """
+
+    __gsignals__ = {
+            'new-data': (gobject.SIGNAL_RUN_FIRST, None,
+                         (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, source, size=2048, hop=512):
+        """Constructor.
+
+        Keywords:
+            source audio source emitting new data (multichannel sources emit
+                   (size, channels) frames).
+            size number of samples of each emitted frame.
+            hop number of samples between the start of consecutive frames.
+        """
+        super(Framer, self).__init__()
+
+        channels = getattr(source, 'channels', 1)
+        self.ring = RingBuffer(size, hop, channels=channels)
+        self.handler = source.connect('new-data', self.new_data_cb)
+        self.source = source
+
+    def new_data_cb(self, source, data):
+        """Collect the new data and emit the frames it completes.
+
+        The emitted frames are views on a preallocated buffer, valid only
+        during the signal emission.
+        """
+        for frame in self.ring.push(data):
+            self.emit('new-data', frame)
+
+    def disconnect_source(self):
+        """Stop collecting data from the source.
+        """
+        self.source.disconnect(self.handler)
+        self.ring.reset()
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing the latency and throughput instrumentation.
+
+Instrumentation is disabled by default: instrumented code checks ENABLED
+before taking any measure, hence the cost is a single attribute lookup.
+Measures are taken from the gstreamer streaming threads and the main loop
+at once: updates are serialized by a lock, taken only when enabled.
+
+Each stage keeps a histogram of its durations (log2 buckets of
+microseconds), and named counters track buffers, drops and rejections.
+Buffers carry their gstreamer timestamp and arrival time through the chain
+by means of a per-thread stamp, set by the sources right before emitting
+new data.
+"""
+
+from __future__ import division
+from threading import Lock
+from threading import local
+from time import time
+import json
+import sys
+
+import gobject
+
+
+# flag indicating wether the instrumentation is enabled.
+ENABLED = False
+
+# number of buckets of each histogram.
+BUCKETS = 32
+
+
+class Histogram(object):
+    """Histogram of durations with logarithmic buckets.
+
+    Bucket i counts durations of less than 2 ** i microseconds (and not
+    less than half of that).
+    """
+
+    def __init__(self):
+        """Constructor.
+        """
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        """Record the given duration.
+        """
+        micros = int(seconds * 1e6)
+        self.counts[min(max(micros, 0).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Return an upper bound of the given percentile, in seconds.
+
+        Keywords:
+            p percentile between 0 and 100.
+        """
+        threshold = self.count * p / 100
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if count and seen >= threshold:
+                return (1 << i) / 1e6
+        return 0
+
+    def summary(self):
+        """Return a dictionary summarizing the histogram.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': self.counts[:],
+        }
+
+
+histograms = {}
+counters = {}
+gauges = {}
+_local = local()
+_lock = Lock()
+
+
+def enable():
+    """Enable the instrumentation.
+    """
+    global ENABLED
+    ENABLED = True
+
+def disable():
+    """Disable the instrumentation.
+    """
+    global ENABLED
+    ENABLED = False
+
+def reset():
+    """Discard the collected measures.
+    """
+    with _lock:
+        histograms.clear()
+        counters.clear()
+        gauges.clear()
+
+def record(stage, seconds):
+    """Record the duration of the given stage.
+    """
+    with _lock:
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram()
+        histogram.add(seconds)
+
+def count(name, value=1):
+    """Increment the given counter.
+    """
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+def gauge(name, value):
+    """Set the given gauge to the given value.
+    """
+    with _lock:
+        gauges[name] = value
+
+def stamp(timestamp, arrival):
+    """Set the stamp of the buffer being processed by the current thread.
+
+    Keywords:
+        timestamp gstreamer timestamp of the buffer, in nanoseconds.
+        arrival time the buffer reached the source, as returned by time().
+    """
+    _local.stamp = (timestamp, arrival)
+
+def current():
+    """Return the stamp of the buffer processed by the current thread.
+
+    Return:
+        Pair containing the gstreamer timestamp and the arrival time of the
+        buffer, or None.
+    """
+    return getattr(_local, 'stamp', None)
+
+def snapshot():
+    """Return a dictionary containing all the collected measures.
+    """
+    with _lock:
+        return {
+            'time': time(),
+            'counters': dict(counters),
+            'gauges': dict(gauges),
+            'stages': dict((stage, histogram.summary())
+                           for (stage, histogram) in histograms.items()),
+        }
+
+def dump(f=sys.stderr):
+    """Write a snapshot of the measures as a line of JSON.
+
+    Keywords:
+        f file object receiving the data.
+    """
+    f.write(json.dumps(snapshot(), sort_keys=True) + '\n')
+    f.flush()
+
+def start_logging(interval=10, f=sys.stderr):
+    """Periodically dump the measures from the main loop.
+
+    Keywords:
+        interval number of seconds between dumps.
+        f file object receiving the data.
+
+    Return:
+        Identifier of the gobject timeout (see stop_logging).
+    """
+    def dump_cb():
+        dump(f)
+        return True
+    return gobject.timeout_add(int(interval * 1000), dump_cb)
+
+def stop_logging(identifier):
+    """Stop the periodic dumps started by start_logging.
+    """
+    gobject.source_remove(identifier)
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing a block based synthesizer.
+
+Blocks of samples are generated with numpy by a bank of phase-continuous
+oscillators: frequency and volume changes are ramped over the next block,
+hence they never produce audible steps. No gstreamer nor sound server is
+needed, and signals can be rendered faster than real time.
+"""
+
+from __future__ import division
+import wave
+
+from numpy import abs
+from numpy import arange
+from numpy import array
+from numpy import clip
+from numpy import concatenate
+from numpy import cumsum
+from numpy import float32
+from numpy import float64
+from numpy import pi
+from numpy import sin
+from numpy import where
+from numpy import zeros
+
+
+def sine(phase):
+    """Sine wave.
+    """
+    return sin(2 * pi * phase)
+
+def square(phase):
+    """Square wave.
+    """
+    return where(phase < .5, 1., -1.)
+
+def saw(phase):
+    """Sawtooth wave.
+    """
+    return 2 * phase - 1
+
+def triangle(phase):
+    """Triangle wave.
+    """
+    return 1 - 4 * abs(phase - .5)
+
+# waveforms available to the oscillators, as functions of the phase (in
+# cycles, between 0 and 1).
+WAVEFORMS = {
+        'sine': sine,
+        'square': square,
+        'saw': saw,
+        'triangle': triangle,
+}
+
+
+class Synth(object):
+    """Bank of phase-continuous oscillators (voices) mixed together.
+    """
+
+    def __init__(self, voices=1, waveform='sine', rate=44100,
+                 blocksize=1024):
+        """Constructor.
+
+        Keywords:
+            voices number of oscillators.
+            waveform initial waveform of every voice (see WAVEFORMS).
+            rate sample rate of the generated signal.
+            blocksize number of samples of each generated block.
+        """
+        if waveform not in WAVEFORMS:
+            raise ValueError('Unknown waveform: {0}'.format(waveform))
+
+        self.rate = rate
+        self.waveforms = [waveform] * voices
+        self.phase = zeros(voices, float64)
+        self.freq = zeros(voices, float64)
+        self.volume = zeros(voices, float64)
+        self.target_freq = self.freq.copy()
+        self.target_volume = self.volume.copy()
+        self.resize(blocksize)
+
+    def resize(self, blocksize):
+        """Change the number of samples of the next blocks.
+
+        Must not be invoked while a block is being generated.
+        """
+        self.blocksize = blocksize
+        # ramp from the previous values (excluded) to the targets (included).
+        self.ramp = arange(1, blocksize + 1) / blocksize
+
+    def set_voice(self, index, freq=None, volume=None, waveform=None):
+        """Change the parameters of a voice, starting from the next block.
+
+        Keywords:
+            index index of the voice.
+            freq new frequency in hertz.
+            volume new volume between 0 and 1.
+            waveform new waveform (see WAVEFORMS).
+        """
+        if freq is not None:
+            self.target_freq[index] = freq
+        if volume is not None:
+            self.target_volume[index] = volume
+        if waveform is not None:
+            if waveform not in WAVEFORMS:
+                raise ValueError('Unknown waveform: {0}'.format(waveform))
+            self.waveforms[index] = waveform
+
+    def block(self):
+        """Generate the next block of samples.
+
+        Targets are read once: set_voice can be invoked from another thread
+        while the block is generated, and the block must end exactly on the
+        values the next one starts from.
+
+        Return:
+            Array of samples bounded between -1 and 1.
+        """
+        target_freq = self.target_freq.copy()
+        target_volume = self.target_volume.copy()
+        ramp = self.ramp
+        freq = self.freq[:, None] + \
+               (target_freq - self.freq)[:, None] * ramp
+        volume = self.volume[:, None] + \
+                 (target_volume - self.volume)[:, None] * ramp
+
+        # the phase of each sample accumulates the ramped frequencies.
+        phase = self.phase[:, None] + cumsum(freq / self.rate, axis=1)
+        phase %= 1
+        self.phase[:] = phase[:, -1]
+        self.freq[:] = target_freq
+        self.volume[:] = target_volume
+
+        data = zeros(self.blocksize, float64)
+        for (i, waveform) in enumerate(self.waveforms):
+            data += WAVEFORMS[waveform](phase[i]) * volume[i]
+        return clip(data, -1, 1).astype(float32)
+
+    def blocks(self, count):
+        """Iterate over the given number of blocks.
+        """
+        for _ in xrange(count):
+            yield self.block()
+
+    def render(self, seconds):
+        """Generate the given amount of signal, as fast as possible.
+
+        Keywords:
+            seconds duration of the signal (rounded up to whole blocks).
+
+        Return:
+            Array of samples bounded between -1 and 1.
+        """
+        count = -(-int(seconds * self.rate) // self.blocksize)
+        if not count:
+            return zeros(0, float32)
+        return concatenate(list(self.blocks(count)))
+
+    def save(self, location, seconds):
+        """Render the given amount of signal to a 16 bit mono WAV file.
+
+        Keywords:
+            location location of the output file.
+            seconds duration of the signal (rounded up to whole blocks).
+        """
+        output = wave.open(location, 'wb')
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(self.rate)
+        output.writeframes(pcm(self.render(seconds)))
+        output.close()
+
+
+def pcm(data):
+    """Convert samples bounded between -1 and 1 to 16 bit signed PCM data.
+
+    Return:
+        String of little-endian PCM data.
+    """
+    return (array(data) * 32767).astype('<i2').tostring()
@@ -6,6 +6,7 @@
 
 from __future__ import division
 from math import pi
+from time import time
 
 import cairo
 import gobject
@@ -19,8 +20,14 @@ class Pad(gtk.DrawingArea):
     Create a drawing area connected to mouse events. Generate a couple of
     values between -1 and +1 depending on the position of the mouse during a 
     drag and drop operation.
+
+    Values can be emitted at a limited rate: in that case the latest value
+    wins, and intermediate ones are discarded.
     """
 
+    # radius of the circles drawn around the pointer (new, erased).
+    RADIUS, OLD_RADIUS = 10, 15
+
     __gsignals__ = {
             'start-dnd': (gobject.SIGNAL_RUN_FIRST, None, ()),
             'dnd-value': (gobject.SIGNAL_RUN_FIRST, None,
@@ -28,13 +35,23 @@ class Pad(gtk.DrawingArea):
             'end-dnd': (gobject.SIGNAL_RUN_FIRST, None, ()),
     }
 
-    def __init__(self):
+    def __init__(self, rate=None):
         """Constructor.
 
         Create a drawing area and connect to mouse events.
+
+        Keywords:
+            rate maximum number of values emitted per second (None means no
+                 limit). To emit values once per audio block, use a null
+                 rate and invoke flush() for each block.
         """
         super(Pad, self).__init__()
 
+        self.rate = rate
+        self.pending = None
+        self.last = 0
+        self.timeout = None
+
         self.oldx, self.oldy = -1, -1
         self.width, self.height = -1, -1
         self.surface, self.cr = None, None
@@ -54,9 +71,11 @@ class Pad(gtk.DrawingArea):
         """
         x, y = event.x, event.y
         self.draw_pointer(self.cr, x, y)
-        self.queue_draw()
+        self.queue_draw_pointer(x, y)
         self.oldx, self.oldy = x, y
         rel_x, rel_y = self.absolute_to_relative(x, y)
+        self.pending = None
+        self.last = time()
         self.emit('dnd-value', rel_x, rel_y)
         self.emit('start-dnd')
         return True
@@ -66,8 +85,9 @@ class Pad(gtk.DrawingArea):
         """
         self.oldx, self.oldy = event.x, event.y
         self.draw_pointer(self.cr, None, None)
-        self.queue_draw()
+        self.queue_draw_pointer(None, None)
         self.oldx, self.oldy = None, None
+        self.flush()
         self.emit('end-dnd')
         return True
 
@@ -105,12 +125,48 @@ class Pad(gtk.DrawingArea):
             state = event.state
         if state & gdk.BUTTON1_MASK or state & gdk.BUTTON3_MASK:
             self.draw_pointer(self.cr, x, y)
-            self.queue_draw()
+            self.queue_draw_pointer(x, y)
             self.oldx, self.oldy = x, y
             rel_x, rel_y = self.absolute_to_relative(x, y)
-            self.emit('dnd-value', rel_x, rel_y)
+            self.emit_value(rel_x, rel_y)
         return True
 
+    def emit_value(self, rel_x, rel_y):
+        """Emit the given value, honoring the rate limit.
+
+        If the limit was hit, the value is kept pending (replacing older
+        pending values) and emitted as soon as possible.
+        """
+        if self.rate is None:
+            self.emit('dnd-value', rel_x, rel_y)
+            return
+
+        self.pending = rel_x, rel_y
+        if not self.rate or self.timeout is not None:
+            return
+        delay = self.last + 1 / self.rate - time()
+        if delay > 0:
+            self.timeout = gobject.timeout_add(int(delay * 1000) + 1,
+                                               self.timeout_cb)
+        else:
+            self.flush()
+
+    def timeout_cb(self):
+        """Emit the pending value when the rate limit allows it.
+        """
+        self.timeout = None
+        self.flush()
+        return False
+
+    def flush(self):
+        """Emit the pending value, if any.
+        """
+        if self.pending is not None:
+            rel_x, rel_y = self.pending
+            self.pending = None
+            self.last = time()
+            self.emit('dnd-value', rel_x, rel_y)
+
     def draw(self, cr, width, height):
         """Draw the white background of the pad widget.
 
@@ -131,14 +187,29 @@ class Pad(gtk.DrawingArea):
             newx new x coordinate of the pointer.
             newy new y coordinate of the pointer.
         """
-        data = [(self.oldx, self.oldy, 15, (0, 0, 0)),
-                (newx, newy, 10, (.8, .8, .8))]
+        data = [(self.oldx, self.oldy, self.OLD_RADIUS, (0, 0, 0)),
+                (newx, newy, self.RADIUS, (.8, .8, .8))]
         for (x, y, radius, (r, g, b)) in data:
             if x and y:
                 cr.set_source_rgb(r, g, b)
                 cr.arc(x, y, radius, 0, 2 * pi)
                 cr.fill()
 
+    def queue_draw_pointer(self, newx, newy):
+        """Invalidate the areas covered by the old and new pointer circles.
+
+        Keywords:
+            newx new x coordinate of the pointer.
+            newy new y coordinate of the pointer.
+        """
+        for (x, y, radius) in [(self.oldx, self.oldy, self.OLD_RADIUS),
+                               (newx, newy, self.RADIUS)]:
+            if x and y:
+                # one extra pixel for antialiasing.
+                left, top = int(x - radius) - 1, int(y - radius) - 1
+                size = 2 * radius + 3
+                self.queue_draw_area(left, top, size, size)
+
     def absolute_to_relative(self, x, y):
         """Convert given coordinate from absolute to relative.
 
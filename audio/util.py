@@ -7,10 +7,323 @@
 from __future__ import division
 from itertools import islice
 from itertools import chain
+from threading import local
 
-from numpy.fft import fft as _fft
+from numpy import abs
+from numpy import add
+from numpy import append
+from numpy import asarray
+from numpy import bartlett
+from numpy import blackman
+from numpy import clip
+from numpy import diff
+from numpy import divide
+from numpy import empty
+from numpy import float32
+from numpy import float64
+from numpy import frombuffer
+from numpy import hamming
+from numpy import hanning
+from numpy import linspace
+from numpy import log10
+from numpy import logspace
+from numpy import maximum
+from numpy import multiply
+from numpy import ones
+from numpy import rint
+from numpy import sqrt
+from numpy import zeros
+from numpy.fft import rfft
 
 
+# scale factor mapping 16 bit signed samples in the range [-1, 1).
+SCALE = float32(1 / 32768)
+
+# window functions available to the fft engine.
+WINDOWS = {
+        'rect': ones,
+        'bartlett': bartlett,
+        'blackman': blackman,
+        'hamming': hamming,
+        'hann': hanning,
+}
+
+
+class RingBuffer(object):
+    """Circular buffer splitting a stream of samples into analysis frames.
+
+    Frames have a fixed size and consecutive frames start hop samples apart,
+    hence they overlap when hop is smaller than size.
+
+    The storage is preallocated and every sample is written twice, once in
+    each half of the buffer: this way the last size samples are always
+    contiguous in memory and frames can be returned as views.
+    """
+
+    def __init__(self, size, hop, dtype=float32, channels=1):
+        """Constructor.
+
+        Keywords:
+            size number of samples of each frame.
+            hop number of samples between the start of consecutive frames.
+            dtype type of the stored samples.
+            channels number of channels of each sample: multichannel frames
+                     have shape (size, channels).
+        """
+        if not 0 < hop <= size:
+            raise ValueError('hop must be between 1 and size: {0}'.format(hop))
+
+        self.size = size
+        self.hop = hop
+        shape = (2 * size,) if channels == 1 else (2 * size, channels)
+        self.buffer = zeros(shape, dtype)
+        self.index = 0
+        self.remaining = size
+
+    def reset(self):
+        """Discard the collected samples.
+        """
+        self.buffer[:] = 0
+        self.index = 0
+        self.remaining = self.size
+
+    def write(self, data):
+        """Store the given samples (at most size of them).
+
+        Keywords:
+            data array of samples.
+        """
+        size = self.size
+        buff = self.buffer
+        index = self.index
+        count = len(data)
+
+        first = min(count, size - index)
+        buff[index:index + first] = data[:first]
+        buff[index + size:index + size + first] = data[:first]
+        if first < count:
+            buff[:count - first] = data[first:]
+            buff[size:size + count - first] = data[first:]
+        self.index = (index + count) % size
+
+    def push(self, data):
+        """Store the given samples and yield the frames they complete.
+
+        Each frame is a view on the internal buffer, valid until the next
+        samples are pushed: consumers willing to keep it have to copy it.
+
+        Keywords:
+            data array (or list) of samples.
+        """
+        data = asarray(data)
+        while len(data):
+            count = min(len(data), self.remaining)
+            self.write(data[:count])
+            data = data[count:]
+            self.remaining -= count
+            if not self.remaining:
+                self.remaining = self.hop
+                yield self.buffer[self.index:self.index + self.size]
+
+
+class Plan(object):
+    """Parameters of the fft computed on frames of a given size.
+    """
+
+    def __init__(self, size, window):
+        """Constructor.
+
+        Keywords:
+            size number of samples of each frame.
+            window name of the window function applied to each frame.
+        """
+        self.size = size
+        self.length = 1 << (size - 1).bit_length() # next power of 2
+        self.bins = self.length // 2
+        self.window = WINDOWS[window](size).astype(float64)
+        # scale the window to unit gain, and take into account the power
+        # loss due to discarding the negative frequencies.
+        self.norm = sqrt(2) / self.window.sum()
+        self.buffers = {}
+
+    def buffer(self, name, shape, dtype=float64):
+        """Return the work buffer with the given name and shape.
+
+        Buffers are allocated the first time they are requested, and then
+        reused by the following calls.
+
+        Keywords:
+            name name of the buffer.
+            shape shape of the buffer.
+            dtype type of the buffer items.
+        """
+        key = (name, shape)
+        buff = self.buffers.get(key)
+        if buff is None:
+            buff = self.buffers[key] = zeros(shape, dtype)
+        return buff
+
+
+class FFT(object):
+    """Fast Fourier transform engine for real input frames.
+
+    Plans (padded length, window and normalization) are cached for each
+    frame size, and work buffers are reused among calls: hence the engine
+    is not thread safe, and the arrays returned by magnitude and decibel
+    are overwritten by the next call.
+
+    Frames can be passed one at a time (1-D arrays) or in batches (2-D
+    arrays, one frame per row) transformed with a single call; multichannel
+    frames of shape (frames, channels) are transformed in a single call by
+    passing their transpose.
+    """
+
+    def __init__(self, window='hann'):
+        """Constructor.
+
+        Keywords:
+            window name of the window function (see WINDOWS).
+        """
+        if window not in WINDOWS:
+            raise ValueError('Unknown window: {0}'.format(window))
+
+        self.window = window
+        self.plans = {}
+
+    def plan(self, size):
+        """Return the plan associated to frames of the given size.
+
+        Keywords:
+            size number of samples of each frame.
+        """
+        plan = self.plans.get(size)
+        if plan is None:
+            plan = self.plans[size] = Plan(size, self.window)
+        return plan
+
+    def transform(self, frames):
+        """Compute the normalized spectrum of the given frames.
+
+        Keywords:
+            frames array of frames (frame samples along the last axis).
+
+        Return:
+            Complex array containing the positive frequencies of each frame.
+        """
+        frames = asarray(frames)
+        plan = self.plan(frames.shape[-1])
+        shape = frames.shape[:-1]
+
+        # the padding area is never written, hence it stays zeroed.
+        padded = plan.buffer('padded', shape + (plan.length,))
+        multiply(frames, plan.window, out=padded[..., :plan.size])
+
+        data = rfft(padded)[..., :plan.bins]
+        data *= plan.norm
+        return data
+
+    def magnitude(self, frames, out=None):
+        """Compute the magnitude of the normalized spectrum of the frames.
+
+        Keywords:
+            frames array of frames (frame samples along the last axis).
+            out array used to store the result; if None a work buffer is used.
+        """
+        data = self.transform(frames)
+        if out is None:
+            plan = self.plan(asarray(frames).shape[-1])
+            out = plan.buffer('magnitude', data.shape)
+        return abs(data, out=out)
+
+    def decibel(self, frames, out=None):
+        """Compute the normalized spectrum of the frames in decibel.
+
+        Keywords:
+            frames array of frames (frame samples along the last axis).
+            out array used to store the result; if None a work buffer is used.
+        """
+        out = self.magnitude(frames, out)
+        # add 1e-15 in order to prevent log10(0); the reference value is 1,
+        # the highest possible peak.
+        add(out, 1e-15, out=out)
+        log10(out, out=out)
+        multiply(out, 20, out=out)
+        return out
+
+
+class BandMap(object):
+    """Map the bins of a spectrum to a smaller number of frequency bands.
+
+    The bins belonging to each band are computed once, then each spectrum
+    is reduced with a single vectorized operation.
+    """
+
+    def __init__(self, length, rate, bands, fmin, fmax, scale='log',
+                 mode='mean'):
+        """Constructor.
+
+        Keywords:
+            length length of the (padded) fft.
+            rate sample rate of the signal.
+            bands number of output bands.
+            fmin lowest frequency of the first band.
+            fmax highest frequency of the last band (cut-off frequency).
+            scale spacing of the bands: 'linear', 'log' or 'mel'.
+            mode reduction applied to the bins of a band: 'mean' or 'max'.
+        """
+        if scale not in ('linear', 'log', 'mel'):
+            raise ValueError('Unknown scale: {0}'.format(scale))
+        if mode not in ('mean', 'max'):
+            raise ValueError('Unknown mode: {0}'.format(mode))
+
+        bins = length // 2
+        fmax = min(fmax, rate / 2)
+        if scale == 'linear':
+            edges = linspace(fmin, fmax, bands + 1)
+        elif scale == 'log':
+            edges = logspace(log10(max(fmin, 1)), log10(fmax), bands + 1)
+        else:
+            edges = mel_to_hz(linspace(hz_to_mel(fmin), hz_to_mel(fmax),
+                                       bands + 1))
+
+        indices = rint(edges * length / rate).astype(int)
+        self.starts = clip(indices[:-1], 0, bins - 1)
+        self.stop = int(clip(indices[-1], self.starts[-1] + 1, bins))
+        # narrow bands could be empty: they show the value of their first bin.
+        counts = diff(append(self.starts, self.stop))
+        self.counts = clip(counts, 1, None).astype(float64)
+        self.bands = bands
+        self.mode = mode
+
+    def __call__(self, data, out=None):
+        """Reduce the given spectrum (or batch of spectrums) to bands.
+
+        Keywords:
+            data array of spectrum bins (bins along the last axis).
+            out array used to store the result; if None a new one is created.
+        """
+        data = data[..., :self.stop]
+        if self.mode == 'max':
+            return maximum.reduceat(data, self.starts, axis=-1, out=out)
+        out = add.reduceat(data, self.starts, axis=-1, out=out)
+        return divide(out, self.counts, out=out)
+
+
+# band maps already computed, indexed by their parameters.
+_bandmaps = {}
+
+def bandmap(length, rate, bands, fmin, fmax, scale='log', mode='mean'):
+    """Return the (cached) band map matching the given parameters.
+
+    Keywords:
+        See BandMap.
+    """
+    key = (length, rate, bands, fmin, fmax, scale, mode)
+    value = _bandmaps.get(key)
+    if value is None:
+        value = _bandmaps[key] = BandMap(*key)
+    return value
+
 def batch(iterable, size):
     """Split the iterable into batchs of given size.
 
@@ -23,30 +336,109 @@ def batch(iterable, size):
         batchiter = islice(sourceiter, size)
         yield list(chain([batchiter.next()], batchiter))
 
+def envelope(data, points, out=None):
+    """Compute the min/max envelope of the data decimated to given points.
+
+    The data is reshaped in one row per output point, then each row is
+    reduced to its minimum and maximum values; trailing samples not filling
+    a whole row are ignored.
+
+    Keywords:
+        data array of samples.
+        points number of output points (if data contains fewer samples, one
+               point per sample is returned).
+        out pair of arrays used to store the minimum and maximum values; if
+            None new arrays are created.
+
+    Return:
+        Pair of arrays containing the minimum and the maximum values.
+    """
+    data = asarray(data)
+    points = min(points, len(data))
+    count = len(data) // points
+    rows = data[:points * count].reshape(points, count)
+    if out is None:
+        return rows.min(axis=1), rows.max(axis=1)
+    mins, maxs = out[0][:points], out[1][:points]
+    return rows.min(axis=1, out=mins), rows.max(axis=1, out=maxs)
+
+def select(data, channel):
+    """Select a channel (or a combination of channels) of the given data.
+
+    Mono (1-D) data is returned unchanged.
+
+    Keywords:
+        data array of samples, with shape (frames, channels).
+        channel index of the channel to select, or one of:
+            'mix' the average of all the channels.
+            'mid' the average of the first two channels.
+            'side' half the difference between the first two channels.
+            None all the channels.
+
+    Return:
+        Array of samples (a view when selecting a single channel).
+    """
+    data = asarray(data)
+    if data.ndim == 1 or channel is None:
+        return data
+    if channel == 'mix':
+        return data.mean(axis=1)
+    if channel == 'mid':
+        return (data[:, 0] + data[:, 1]) / 2
+    if channel == 'side':
+        return (data[:, 0] - data[:, 1]) / 2
+    return data[:, channel]
+
+def hz_to_mel(freq):
+    """Convert the given frequency from hertz to mel.
+    """
+    return 2595 * log10(1 + freq / 700)
+
+def mel_to_hz(mel):
+    """Convert the given frequency from mel to hertz.
+    """
+    return 700 * (10 ** (mel / 2595) - 1)
+
+def decode(data, out=None):
+    """Convert raw 16 bit signed little-endian PCM data into float samples.
+
+    The raw data is wrapped without copying it, and then scaled directly
+    into the output array.
+
+    Keywords:
+        data string (or any object exposing the buffer interface) of raw data.
+        out float32 array used to store the result: it must have exactly one
+            item for each input sample. If None, a new array is allocated.
+
+    Return:
+        Array of samples bounded between -1 and 1.
+    """
+    samples = frombuffer(data, dtype='<i2')
+    if out is None:
+        out = empty(len(samples), float32)
+    multiply(samples, SCALE, out=out)
+    return out
+
+# engines backing fft(), one per thread: their work buffers are not shared.
+_local = local()
+
 def fft(data):
     """Compute the fast Fourier transform on the input data.
 
     The normalized output is relative to the positive frequencies and takes
     into account the power loss due to discarding half of the result.
 
+    Reentrant: each thread uses its own engine (rectangular window, as it
+    always used to be).
+
     Keywords:
         data list of data values.
 
     Return:
         Normalized fft.
     """
-    def nextpow(x, b):
-        """Find the smallest integer p such that b ** p >= x.
-        """
-        p = 0
-        n = 1
-        while n < x:
-            n *= b
-            p += 1
-        return p
-
-    N = len(data)
-    M = 2 ** nextpow(len(data), 2)
-    normfact = 1.4142135623730951 / N
-    data = normfact * _fft(data, M)
-    return data[:N // 2]
+    engine = getattr(_local, 'engine', None)
+    if engine is None:
+        engine = _local.engine = FFT('rect')
+    data = asarray(data)
+    return engine.transform(data)[:len(data) // 2]
@@ -5,32 +5,87 @@
 """
 
 from __future__ import division
+from threading import Lock
+from time import time
 
 import cairo
+import gobject
 import gtk
-from numpy import abs
-from numpy import log10
+from numpy import add
+from numpy import arange
+from numpy import asarray
+from numpy import clip
+from numpy import empty
+from numpy import float32
+from numpy import float64
+from numpy import interp
+from numpy import intp
+from numpy import linspace
+from numpy import maximum
+from numpy import minimum
+from numpy import multiply
 from numpy import pi
+from numpy import rint
 from numpy import sin
+from numpy import subtract
+from numpy import uint32
+from numpy import zeros
 
-from audio.util import fft
-from audio.util import batch
+from audio import stats
+from audio.hub import Frame
+from audio.util import bandmap
+from audio.util import envelope
+from audio.util import FFT
+from audio.util import select
 
 
 class Visualizer(gtk.DrawingArea):
     """Base class used by inheritance from the various specific visualizers.
+
+    New data is not drawn right away: only the latest pending data is kept,
+    and it is drawn from the main loop at most fps times per second. This
+    way the threads emitting data never wait for the drawing operations.
+
+    New data is copied into one of two preallocated buffers, the one not
+    being drawn, and work buffers depending on the size of the drawing area
+    are allocated when it changes (see allocate): in the steady state no
+    array is allocated.
     """
 
-    def __init__(self):
+    def __init__(self, fps=30, channel='mix'):
         """Constructor.
 
         Create a drawing area used to display audio visualizations.
+
+        Keywords:
+            fps maximum number of frames drawn per second (None means no
+                limit: pending data is drawn as soon as the main loop is
+                idle).
+            channel channel of multichannel data to display (see
+                    util.select).
         """
         super(Visualizer, self).__init__()
 
+        self.channel = channel
+
         self.data = []
+        self.buffers = [empty(0, float32), empty(0, float32)]
+        self.back = 0
+        self.width = self.height = 0
         self.surface = self.context = None
 
+        self.fps = fps
+        self.lock = Lock()
+        self.pending = None
+        self.stamp = self.pending_stamp = None
+        self.scheduled = False
+        self.last = 0
+        self.count = 0
+
+        # frames received, drawn, dropped because replaced by newer data
+        # before being drawn, and drawn in place of more than one frame.
+        self.frames = self.drawn = self.dropped = self.coalesced = 0
+
         self.connect('configure-event', self.configure_cb)
         self.connect('expose-event', self.expose_cb)
 
@@ -38,18 +93,34 @@ class Visualizer(gtk.DrawingArea):
         """Create a private surface and its cairo context.
         """
         width, height = darea.window.get_size()
+        self.resize(width, height)
+        if len(self.data):
+            self.draw(self.context)
+
+        return True
+
+    def resize(self, width, height):
+        """Create a private surface of the given size and its cairo context.
+
+        The widget does not need to be realized: visualizers can draw
+        offscreen by resizing them and invoking draw on their context.
+        """
+        self.width, self.height = width, height
         self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
                                           width,
                                           height)
         self.context = cairo.Context(self.surface)
         self.context.scale(width / 2, height / 2)
         self.context.translate(1, 1)
-
-        return True
+        self.allocate()
 
     def expose_cb(self, darea, event):
         """Redraw either the whole window or a part of it.
         """
+        instrument = stats.ENABLED
+        if instrument:
+            start = time()
+
         context = darea.window.cairo_create()
 
         context.rectangle(event.area.x, event.area.y,
@@ -58,8 +129,21 @@ class Visualizer(gtk.DrawingArea):
         context.set_source_surface(self.surface, 0, 0)
         context.paint()
 
+        if instrument:
+            end = time()
+            stats.record('expose', end - start)
+            # end to end latency of the buffer drawn last.
+            if self.stamp is not None:
+                stats.record('latency', end - self.stamp[1])
+                self.stamp = None
+
         return False
 
+    def allocate(self):
+        """Allocate the work buffers depending on the size of the area.
+        """
+        pass
+
     def draw(self, context):
         """Redraw the drawing area.
 
@@ -68,33 +152,140 @@ class Visualizer(gtk.DrawingArea):
         """
         pass
 
+    def store(self, data):
+        """Copy the given data into the buffer not being drawn.
+
+        Must be invoked holding the lock; the buffer grows only when the
+        data does not fit.
+
+        Return:
+            View of the buffer containing the data.
+        """
+        buff = self.buffers[self.back]
+        if len(buff) < len(data) or buff.shape[1:] != data.shape[1:]:
+            buff = self.buffers[self.back] = empty(data.shape, float32)
+        buff = buff[:len(data)]
+        buff[...] = data
+        return buff
+
     def refresh(self, data):
         """Refresh the data displayed on screen.
 
+        Can be invoked from any thread: the data is stored and the drawing
+        is scheduled in the main loop.
+
         Keywords:
-            data list of values supposed to be bounded between -(2 ** 15) and
-                 ((2 ** 15) - 1).
+            data array (or list) of values supposed to be bounded between -1
+                 and 1. The values are copied, since sources reuse their
+                 arrays. Frames emitted by a hub (see audio.hub) are kept
+                 as they are, and their shared products are used.
         """
-        self.data[:] = data
-        self.draw(self.context)
-        self.queue_draw()
+        instrument = stats.ENABLED
+        if instrument:
+            start = time()
+
+        frame = isinstance(data, Frame)
+        if not frame:
+            data = select(asarray(data), self.channel)
+        with self.lock:
+            if not frame:
+                data = self.store(data)
+            self.frames += 1
+            self.count += 1
+            dropped = self.pending is not None
+            if dropped:
+                self.dropped += 1
+            self.pending = data
+            self.pending_stamp = stats.current() if instrument else None
+            schedule = not self.scheduled
+            self.scheduled = True
+        if schedule:
+            gobject.idle_add(self.render_cb)
+
+        if instrument:
+            if dropped:
+                stats.count('dropped')
+            stats.record('refresh', time() - start)
+
+    def render_cb(self):
+        """Draw the pending data, unless the frame rate limit was hit.
+
+        In that case the drawing is postponed to the right moment.
+        """
+        if self.fps:
+            delay = self.last + 1 / self.fps - time()
+            if delay > 0:
+                gobject.timeout_add(int(delay * 1000) + 1, self.render_cb)
+                return False
+
+        with self.lock:
+            data, self.pending = self.pending, None
+            stamp, self.pending_stamp = self.pending_stamp, None
+            count, self.count = self.count, 0
+            self.scheduled = False
+            # the next data goes to the buffer drawn until now.
+            if data is not None and not isinstance(data, Frame):
+                self.back = 1 - self.back
+        if data is None:
+            return False
+
+        self.data = data
+        if self.context is not None:
+            self.last = time()
+            self.draw(self.context)
+            self.queue_draw()
+            self.drawn += 1
+            if count > 1:
+                self.coalesced += 1
+
+            if stats.ENABLED:
+                stats.record('draw', time() - self.last)
+                if stamp is not None:
+                    stats.record('queue', self.last - stamp[1])
+                    self.stamp = stamp
+
+        return False
 
 
 class Analyzer(Visualizer):
     """Display the spectrum analyzer of the input audio signal.
     """
 
-    def __init__(self, threshold=-60, bands=128):
+    def __init__(self, threshold=-60, bands=128, fmin=20, fmax=20000,
+                 scale='log', window='hann', rate=44100, fps=30,
+                 spectrum=False, channel='mix'):
         """Constructor.
 
         Keywords:
             threshold threshold value (in dB) used to display fft data.
-            bands number of output values extracted from fft.
+            bands number of displayed bars.
+            fmin lowest displayed frequency.
+            fmax cut-off frequency: higher frequencies are not displayed.
+            scale spacing of the bands: 'linear', 'log' or 'mel'.
+            window name of the window function applied before the fft.
+            rate sample rate of the input audio signal.
+            fps maximum number of frames drawn per second.
+            spectrum flag indicating wether the input data is made of
+                     precomputed spectrums in dB (e.g. replayed from a
+                     cache) instead of audio samples.
+            channel channel of multichannel data to display.
         """
-        super(Analyzer, self).__init__()
+        super(Analyzer, self).__init__(fps, channel)
 
+        self.spectrum = spectrum
         self.threshold = threshold
         self.bands = bands
+        self.fmin = fmin
+        self.fmax = fmax
+        self.scale = scale
+        self.rate = rate
+        self.window = window
+        self.engine = FFT(window)
+
+        # work buffers: band values, bar heights and bar positions.
+        self.values = empty(bands, float64)
+        self.heights = empty(bands, float64)
+        self.positions = (-1 + (arange(bands) + .5) * 2 / bands).tolist()
 
     def draw(self, context):
         """Redraw the drawing area.
@@ -107,59 +298,68 @@ class Analyzer(Visualizer):
         context.fill()
 
         threshold = self.threshold
-        bands = self.bands
         data = self.data
 
-        # compute the fft and trasform it in decibel notation:
-        # - add 1e-15 in order to prevent log10(0).
-        # - we divide by 1 because it is supposed to be the highest peak.
-        data = 20 * log10(abs(fft(data) + 1e-15) / 1)
-
-        # how many values we have to merge in order to achieve the desired
-        # number of bands
-        group = len(data) / bands
-        data = [sum(seq) / len(seq) for seq in batch(data, group)]
-
-        # is it possible to obtain more values that needed; we simply ignore
-        # them (they refer to high value of frequencies.
-        data[:] = data[:bands]
-
-        ## data = 20 * log10(abs(fft(data[:512]) + 1e-15) / 1)
-        ## temp = []
-        ## data = [max(data[2 ** i:2 ** (i + 1)]) for i in xrange(8)]
+        # compute the fft and trasform it in decibel notation, then merge
+        # the bins belonging to the same band; frames emitted by a hub share
+        # the result with the other visualizers.
+        if isinstance(data, Frame):
+            data = data.bands(self.bands, self.fmin, self.fmax, self.scale,
+                              self.window, self.channel)
+        else:
+            if self.spectrum:
+                length = 2 * len(data)
+            else:
+                length = self.engine.plan(len(data)).length
+                data = self.engine.decibel(data)
+            bands = bandmap(length, self.rate, self.bands, self.fmin,
+                            self.fmax, self.scale)
+            data = bands(data, self.values)
+
+        # map the values above the threshold to the heights of the bars.
+        heights = self.heights
+        maximum(data, threshold, out=heights)
+        subtract(heights, threshold, out=heights)
+        multiply(heights, 2 / threshold, out=heights)
+        add(heights, 1, out=heights)
 
         # color stuff.
         context.set_source_rgb(.8, .8, .8)
 
-        # actual rendering.
-        width = 2 / len(data)
-        context.set_line_width(width)
-
-        x = -1 + width / 2
-        for value in data:
+        # actual rendering: all the bars are stroked as a single path.
+        context.set_line_width(2 / self.bands)
+        for (x, y) in zip(self.positions, heights.tolist()):
             context.move_to(x, 1)
-            if value < threshold:
-                value = threshold
-            y = 1 - (value - threshold) / (-threshold) * 2
             context.line_to(x, y)
-
-            context.stroke()
-            x += width
+        context.stroke()
 
 
 class Oscilloscope(Visualizer):
     """Display the shape of the input audio signal.
+
+    The signal is decimated to one point per pixel, keeping the min/max
+    envelope of the samples so that transients stay visible.
     """
 
-    def __init__(self, fill=False):
+    def __init__(self, fill=False, fps=30, channel='mix'):
         """Constructor.
 
         Keywords:
-            fill flag indicating wether to fill or not the audio shape.
+            fill flag indicating wether to fill or not the area between the
+                 audio shape and the zero line.
+            fps maximum number of frames drawn per second.
+            channel channel of multichannel data to display.
         """
-        super(Oscilloscope, self).__init__()
+        super(Oscilloscope, self).__init__(fps, channel)
 
         self.fill = fill
+        self.mins = self.maxs = empty(0, float32)
+
+    def allocate(self):
+        """Allocate the envelope buffers: one point per pixel.
+        """
+        self.mins = empty(self.width, float32)
+        self.maxs = empty(self.width, float32)
 
     def draw(self, context):
         """Redraw the drawing area.
@@ -167,31 +367,258 @@ class Oscilloscope(Visualizer):
         Keywords:
             context surface used for drawing actions.
         """
+        if not len(self.data) or not self.width:
+            self.draw_envelope(context, [], [])
+            return
+
+        if len(self.mins) != self.width:
+            self.allocate()
+        if isinstance(self.data, Frame):
+            mins, maxs = self.data.envelope(self.width, self.channel)
+        else:
+            mins, maxs = envelope(self.data, self.width,
+                                  (self.mins, self.maxs))
+        self.draw_envelope(context, mins, maxs)
+
+    def draw_envelope(self, context, mins, maxs):
+        """Redraw the drawing area showing the given envelope.
+
+        Keywords:
+            context surface used for drawing actions.
+            mins array of minimum values (one per point).
+            maxs array of maximum values (one per point).
+        """
         context.set_source_rgb(0, 0, 0)
         context.rectangle(-1, -1, 2, 2)
         context.fill()
 
-        fill = self.fill
-        data = self.data
+        if not len(mins):
+            return
 
-        group = len(data) / 256
-        data = [sum(seq) / len(seq) for seq in batch(data, group)]
+        if self.fill:
+            count = len(mins)
+            if len(self.mins) < count:
+                self.mins = empty(count, float32)
+                self.maxs = empty(count, float32)
+            mins = minimum(mins, 0, out=self.mins[:count])
+            maxs = maximum(maxs, 0, out=self.maxs[:count])
 
         # color stuff.
         context.set_source_rgb(.8, .8, .8)
 
-        # actual rendering.
-        width = 2 / len(data)
-        context.set_line_width(width)
+        # actual rendering: the upper side of the envelope from left to
+        # right, then the lower one backwards.
+        width = 2 / len(mins)
+        context.set_line_width(2 / self.height)
 
         x = -1 + width / 2
-        context.move_to(x, 0)
-        for value in data:
-            y = -value
-            context.line_to(x, y)
+        for value in maxs.tolist():
+            context.line_to(x, -value)
             x += width
-        context.line_to(1 - width / 2, 0)
-        if fill:
-            context.fill()
+        for value in reversed(mins.tolist()):
+            x -= width
+            context.line_to(x, -value)
+        context.close_path()
+        # stroke the outline as well: flat envelopes have no area to fill.
+        context.fill_preserve()
+        context.stroke()
+
+    def show(self, overview, start, stop):
+        """Display the given time range of a waveform overview.
+
+        Must be invoked from the main loop; the cost depends on the width
+        of the widget, not on the length of the range.
+
+        Keywords:
+            overview waveform overview (see audio.overview).
+            start time of the beginning of the range, in seconds.
+            stop time of the end of the range, in seconds.
+        """
+        if self.context is None:
+            return
+        mins, maxs, _ = overview.query(start, stop, self.width)
+        self.draw_envelope(self.context, mins, maxs)
+        self.queue_draw()
+
+
+def colormap(stops, size=256):
+    """Compute the lookup table of a colormap.
+
+    Keywords:
+        stops list of (position, red, green, blue) tuples, with position
+              and color components between 0 and 1, sorted by position.
+        size number of entries of the table.
+
+    Return:
+        Array of 32 bit pixels (0xRRGGBB) in the cairo RGB24 format.
+    """
+    positions = linspace(0, 1, size)
+    table = zeros(size, uint32)
+    for (i, shift) in ((1, 16), (2, 8), (3, 0)):
+        component = interp(positions, [stop[0] for stop in stops],
+                           [stop[i] for stop in stops])
+        table |= rint(component * 255).astype(uint32) << shift
+    return table
+
+# default colormap of the spectrogram: black, blue, red, yellow, white.
+HEAT = colormap([(0, 0, 0, 0), (.25, 0, 0, .6), (.5, .8, 0, .3),
+                 (.75, 1, .8, 0), (1, 1, 1, 1)])
+
+
+class Spectrogram(Visualizer):
+    """Display the scrolling spectrogram (waterfall) of the input signal.
+
+    The history is kept in a circular image, one column per frame: each new
+    frame writes only its own column, colored by means of a lookup table,
+    and the image is blitted in two pieces starting from the oldest column.
+    Hence the cost of a frame does not depend on the length of the history.
+
+    Frames are never coalesced: every received frame is queued and gets its
+    own column, only the blit is limited to fps times per second, so the
+    time axis follows the audio whatever the frame rate.
+    """
+
+    def __init__(self, threshold=-60, fmin=20, fmax=20000, scale='log',
+                 window='hann', rate=44100, fps=30, spectrum=False,
+                 channel='mix', lut=HEAT):
+        """Constructor.
+
+        Keywords:
+            threshold threshold value (in dB) mapped to the first color.
+            fmin lowest displayed frequency.
+            fmax cut-off frequency: higher frequencies are not displayed.
+            scale spacing of the rows: 'linear', 'log' or 'mel'.
+            window name of the window function applied before the fft.
+            rate sample rate of the input audio signal.
+            fps maximum number of frames drawn per second.
+            spectrum flag indicating wether the input data is made of
+                     precomputed spectrums in dB instead of audio samples.
+            channel channel of multichannel data to display.
+            lut lookup table mapping levels to colors (see colormap).
+        """
+        super(Spectrogram, self).__init__(fps, channel)
+
+        self.threshold = threshold
+        self.fmin = fmin
+        self.fmax = fmax
+        self.scale = scale
+        self.window = window
+        self.rate = rate
+        self.spectrum = spectrum
+        self.lut = lut
+        self.engine = FFT(window)
+        self.image = self.history = None
+        self.column = 0
+        # frames received and not written yet, and data written last.
+        self.queue = []
+        self.written = None
+
+    def refresh(self, data):
+        """Queue the data for its own column and schedule the drawing.
+
+        At most width frames are queued: older ones would be scrolled out
+        of the history anyway.
+        """
+        if not isinstance(data, Frame):
+            # sources reuse their arrays.
+            data = select(asarray(data), self.channel).astype(float32)
+        with self.lock:
+            self.queue.append(data)
+            if len(self.queue) > self.width:
+                del self.queue[:len(self.queue) - self.width]
+        super(Spectrogram, self).refresh(data)
+
+    def allocate(self):
+        """Allocate the circular image and the work buffers of a column.
+
+        The history is discarded.
+        """
+        width, height = self.width, self.height
+        stride = cairo.ImageSurface.format_stride_for_width(
+                cairo.FORMAT_RGB24, width)
+        self.image = zeros((height, stride // 4), uint32)
+        self.history = cairo.ImageSurface.create_for_data(
+                self.image, cairo.FORMAT_RGB24, width, height, stride)
+        self.column = 0
+        self.written = None
+        # work buffers: band values, color indices and colors.
+        self.values = empty(height, float64)
+        self.indices = empty(height, intp)
+        self.colors = empty(height, uint32)
+
+    def draw(self, context):
+        """Add the queued frames to the history and redraw the drawing area.
+
+        Data assigned directly (e.g. when drawing offscreen) is added when
+        nothing is queued. Data already added (e.g. when redrawing after a
+        resize) is not added again: the history is only blitted.
+
+        Keywords:
+            context surface used for drawing actions.
+        """
+        width, height = self.width, self.height
+        if not width or not height:
+            return
+        if (self.history is None or self.history.get_width() != width or
+                self.history.get_height() != height):
+            self.allocate()
+
+        with self.lock:
+            queue, self.queue = self.queue, []
+        if not queue and len(self.data) and self.data is not self.written:
+            queue = [self.data]
+        if queue:
+            self.history.flush()
+            for data in queue:
+                self.write(data)
+            self.history.mark_dirty()
+        self.written = self.data
+
+        # the oldest column is the next one to be written: it goes on the
+        # left, followed by the newest columns.
+        context.save()
+        context.identity_matrix()
+        split = width - self.column
+        context.set_source_surface(self.history, -self.column, 0)
+        context.rectangle(0, 0, split, height)
+        context.fill()
+        context.set_source_surface(self.history, split, 0)
+        context.rectangle(split, 0, self.column, height)
+        context.fill()
+        context.restore()
+
+    def write(self, data):
+        """Write the column of the given data into the history.
+
+        The surface of the history must be flushed.
+        """
+        height = self.height
+        if not len(data):
+            return
+
+        # one band per row.
+        if isinstance(data, Frame):
+            data = data.bands(height, self.fmin, self.fmax, self.scale,
+                              self.window, self.channel)
         else:
-            context.stroke()
+            if self.spectrum:
+                length = 2 * len(data)
+            else:
+                length = self.engine.plan(len(data)).length
+                data = self.engine.decibel(data)
+            bands = bandmap(length, self.rate, height, self.fmin,
+                            self.fmax, self.scale)
+            data = bands(data, self.values)
+
+        # map the levels above the threshold to the lookup table.
+        values = self.values
+        size = len(self.lut)
+        subtract(data, self.threshold, out=values)
+        multiply(values, (size - 1) / -self.threshold, out=values)
+        clip(values, 0, size - 1, out=values)
+        self.indices[...] = values
+        self.lut.take(self.indices, out=self.colors)
+
+        # low frequencies at the bottom.
+        self.image[::-1, self.column] = self.colors
+        self.column = (self.column + 1) % self.width
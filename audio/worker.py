@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Module containing objects used to analyze audio data in background.
+"""
+
+from __future__ import division
+from Queue import Empty
+from Queue import Full
+from Queue import Queue
+from threading import Lock
+from threading import Thread
+
+import gobject
+from numpy import array
+from numpy import float32
+from numpy import sqrt
+
+from audio.util import bandmap
+from audio.util import FFT
+
+
+class Analysis(object):
+    """Default analysis run by workers on each frame of data.
+
+    Compute the spectrum of the frame (in dB), its bands and the RMS and
+    peak levels of the signal.
+    """
+
+    def __init__(self, bands=128, fmin=20, fmax=20000, scale='log',
+                 window='hann', rate=44100):
+        """Constructor.
+
+        Keywords:
+            bands number of bands extracted from the spectrum.
+            fmin lowest frequency of the first band.
+            fmax highest frequency of the last band.
+            scale spacing of the bands: 'linear', 'log' or 'mel'.
+            window name of the window function applied before the fft.
+            rate sample rate of the input audio signal.
+        """
+        self.bands = bands
+        self.fmin = fmin
+        self.fmax = fmax
+        self.scale = scale
+        self.rate = rate
+        self.engine = FFT(window)
+
+    def __call__(self, frame):
+        """Analyze the given frame.
+
+        Multichannel frames are analyzed one channel per row, with a single
+        fft call.
+
+        Keywords:
+            frame array of samples bounded between -1 and 1, with shape
+                  (frames, channels) for multichannel data.
+
+        Return:
+            Dictionary containing the 'spectrum', 'bands', 'rms' and 'peak'
+            values of the frame (one row or item per channel for
+            multichannel data).
+        """
+        frames = frame.T
+        length = self.engine.plan(frames.shape[-1]).length
+        bands = bandmap(length, self.rate, self.bands, self.fmin, self.fmax,
+                        self.scale)
+        # the engine reuses its work buffers, results must be copied.
+        spectrum = self.engine.decibel(frames).copy()
+        rms = sqrt((frames * frames).mean(axis=-1))
+        peak = abs(frames).max(axis=-1)
+        return {
+            'spectrum': spectrum,
+            'bands': bands(spectrum),
+            'rms': rms if frame.ndim > 1 else float(rms),
+            'peak': peak if frame.ndim > 1 else float(peak),
+        }
+
+
+class Worker(gobject.GObject):
+    """Analyze the data emitted by a source in a background thread.
+
+    Frames are copied into a bounded queue on the thread emitting them, and
+    analyzed by the worker thread; results are emitted from the main loop.
+    When the queue is full, the overflow policy decides what happens:
+        drop-oldest the oldest queued frame is discarded.
+        drop-newest the new frame is discarded.
+        block the emitting thread waits for the worker.
+    """
+
+    __gsignals__ = {
+            'new-result': (gobject.SIGNAL_RUN_FIRST, None,
+                           (gobject.TYPE_PYOBJECT,)),
+    }
+
+    POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+    def __init__(self, source, analysis=None, capacity=4,
+                 policy='drop-oldest'):
+        """Constructor.
+
+        Keywords:
+            source audio source emitting new data.
+            analysis callable invoked with each frame, returning the result
+                     to emit; if None an Analysis instance is used.
+            capacity maximum number of frames waiting to be analyzed.
+            policy overflow policy (see POLICIES).
+        """
+        super(Worker, self).__init__()
+
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown policy: {0}'.format(policy))
+
+        self.analysis = analysis if analysis is not None else Analysis()
+        self.capacity = capacity
+        self.policy = policy
+        self.queue = Queue(capacity)
+        self.lock = Lock()
+        self.processed = self.dropped = self.failed = 0
+        # last exception raised by the analysis, if any.
+        self.error = None
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.handler = source.connect('new-data', self.new_data_cb)
+        self.source = source
+
+    def depth(self):
+        """Return the number of frames waiting to be analyzed.
+        """
+        return self.queue.qsize()
+
+    def new_data_cb(self, source, data):
+        """Queue a copy of the new data, applying the overflow policy.
+        """
+        frame = array(data, float32)
+        if self.policy == 'block':
+            self.queue.put(frame)
+        elif self.policy == 'drop-newest':
+            try:
+                self.queue.put_nowait(frame)
+            except Full:
+                self.drop()
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(frame)
+                    break
+                except Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.drop()
+                    except Empty:
+                        pass
+
+    def drop(self):
+        """Account for a dropped frame.
+        """
+        with self.lock:
+            self.dropped += 1
+
+    def fail(self, error):
+        """Account for a frame whose analysis raised the given exception.
+        """
+        with self.lock:
+            self.failed += 1
+            self.error = error
+
+    def run(self):
+        """Analyze the queued frames until stopped.
+
+        Frames whose analysis raises an exception are counted as failed
+        (see error) and skipped: the thread keeps consuming the queue, so
+        that blocked emitters are never stuck.
+        """
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                result = self.analysis(frame)
+            except Exception as e:
+                self.fail(e)
+                continue
+            self.processed += 1
+            gobject.idle_add(self.emit_result, result)
+
+    def emit_result(self, result):
+        """Emit the given result from the main loop.
+        """
+        self.emit('new-result', result)
+        return False
+
+    def stop(self):
+        """Disconnect from the source and stop the worker thread.
+
+        Frames still queued are discarded.
+        """
+        self.source.disconnect(self.handler)
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        self.queue.put(None)
+        self.thread.join()
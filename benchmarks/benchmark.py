@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Offscreen benchmarks of the decode, fft, band map and render hot paths.
+
+Synthetic 16 bit buffers of various sizes are fed through each stage, and
+through the whole chain; drawing happens on cairo image surfaces, hence no
+display nor sound server is needed.
+"""
+
+from __future__ import division
+from argparse import ArgumentParser
+from timeit import default_timer
+import json
+import sys
+
+import cairo
+import gst
+from numpy import arange
+from numpy import percentile
+from numpy import pi
+from numpy import random
+from numpy import sin
+
+import audio.source
+import audio.visual
+from audio.util import bandmap
+from audio.util import batch
+from audio.util import decode
+from audio.util import envelope
+from audio.util import fft
+from audio.util import FFT
+
+
+CAPS = '''audio/x-raw-int,
+        channels=1,
+        rate=44100,
+        width=16,
+        depth=16,
+        signed=true,
+        endianness=1234'''
+
+# buffer sizes (in samples) used when not specified.
+SIZES = (256, 1024, 4096, 16384)
+
+# size of the offscreen surfaces.
+WIDTH, HEIGHT = 512, 256
+
+
+def synthetic(size):
+    """Return raw 16 bit data containing a noisy tone of the given size.
+    """
+    t = arange(size) / 44100
+    data = .5 * sin(2 * pi * 440 * t) + .1 * random.uniform(-1, 1, size)
+    return (data * 32767).astype('<i2').tostring()
+
+def surface(visualizer):
+    """Prepare an offscreen surface for the given visualizer.
+
+    Return:
+        Cairo context of the surface, scaled like the visualizers do.
+    """
+    image = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    context = cairo.Context(image)
+    context.scale(WIDTH / 2, HEIGHT / 2)
+    context.translate(1, 1)
+    visualizer.width, visualizer.height = WIDTH, HEIGHT
+    return context
+
+def bench_decode(size):
+    raw = synthetic(size)
+    out = decode(raw)
+    return lambda: decode(raw, out)
+
+def bench_handoff(size):
+    source = audio.source.Source('fakesrc ! fakesink name=fsink', False,
+                                 False)
+    buff = gst.Buffer(synthetic(size))
+    buff.set_caps(gst.Caps(CAPS))
+    return lambda: source.handoff_cb(None, buff, None)
+
+def bench_fft(size):
+    data = decode(synthetic(size))
+    return lambda: fft(data)
+
+def bench_engine(size):
+    data = decode(synthetic(size))
+    engine = FFT('hann')
+    return lambda: engine.decibel(data)
+
+def bench_batch(size):
+    data = decode(synthetic(size)).tolist()
+    return lambda: [sum(seq) / len(seq) for seq in batch(data, 16)]
+
+def bench_bandmap(size):
+    engine = FFT('hann')
+    spectrum = engine.decibel(decode(synthetic(size))).copy()
+    bands = bandmap(engine.plan(size).length, 44100, 128, 20, 20000)
+    return lambda: bands(spectrum)
+
+def bench_envelope(size):
+    data = decode(synthetic(size))
+    return lambda: envelope(data, WIDTH)
+
+def bench_analyzer(size):
+    analyzer = audio.visual.Analyzer()
+    context = surface(analyzer)
+    analyzer.data = decode(synthetic(size))
+    return lambda: analyzer.draw(context)
+
+def bench_oscilloscope(size):
+    oscilloscope = audio.visual.Oscilloscope()
+    context = surface(oscilloscope)
+    oscilloscope.data = decode(synthetic(size))
+    return lambda: oscilloscope.draw(context)
+
+def bench_spectrogram(size):
+    spectrogram = audio.visual.Spectrogram()
+    context = surface(spectrogram)
+    data = decode(synthetic(size))
+
+    def run():
+        # a fresh view is a new frame: its column is written, not only the
+        # history blitted.
+        spectrogram.data = data[:]
+        spectrogram.draw(context)
+    return run
+
+def bench_chain(size):
+    raw = synthetic(size)
+    out = decode(raw)
+    analyzer = audio.visual.Analyzer()
+    context = surface(analyzer)
+
+    def run():
+        analyzer.data = decode(raw, out)
+        analyzer.draw(context)
+    return run
+
+# benchmarked stages, in execution order.
+STAGES = (
+        ('decode', bench_decode),
+        ('handoff', bench_handoff),
+        ('fft', bench_fft),
+        ('engine', bench_engine),
+        ('batch', bench_batch),
+        ('bandmap', bench_bandmap),
+        ('envelope', bench_envelope),
+        ('analyzer', bench_analyzer),
+        ('oscilloscope', bench_oscilloscope),
+        ('spectrogram', bench_spectrogram),
+        ('chain', bench_chain),
+)
+
+
+def measure(run, size, repeat):
+    """Time the given callable.
+
+    Return:
+        Dictionary containing the latency percentiles (in microseconds) and
+        the throughput of the stage.
+    """
+    for _ in xrange(min(10, repeat)):
+        run()
+
+    timings = []
+    for _ in xrange(repeat):
+        start = default_timer()
+        run()
+        timings.append(default_timer() - start)
+
+    mean = sum(timings) / len(timings)
+    p50, p90, p99 = percentile(timings, [50, 90, 99]) * 1e6
+    return {
+        'p50': p50,
+        'p90': p90,
+        'p99': p99,
+        'frames/s': 1 / mean,
+        'samples/s': size / mean,
+    }
+
+def compare(results, baseline, tolerance):
+    """Compare the results with the baseline.
+
+    Return:
+        List of the keys whose median latency regressed more than the given
+        tolerance.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key in baseline:
+            if result['p50'] > baseline[key]['p50'] * (1 + tolerance):
+                regressions.append(key)
+    return regressions
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0], description=__doc__.split('\n')[0])
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help='stage to run (default: all)')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES,
+                        help='buffer sizes in samples')
+    parser.add_argument('-n', '--repeat', type=int, default=200,
+                        help='number of timed runs')
+    parser.add_argument('--save', metavar='PATH',
+                        help='store the results as the new baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='flag regressions against the given baseline')
+    parser.add_argument('--tolerance', type=float, default=.1,
+                        help='allowed slowdown before flagging (0.1 = 10%%)')
+    args = parser.parse_args(argv[1:])
+
+    stages = [(name, factory) for (name, factory) in STAGES
+              if not args.stages or name in args.stages]
+
+    results = {}
+    print '{0:<24} {1:>10} {2:>10} {3:>10} {4:>12} {5:>14}'.format(
+            'stage', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'frames/s',
+            'samples/s')
+    for (name, factory) in stages:
+        for size in args.sizes:
+            key = '{0}/{1}'.format(name, size)
+            result = results[key] = measure(factory(size), size, args.repeat)
+            print '{0:<24} {1:>10.1f} {2:>10.1f} {3:>10.1f} {4:>12.0f} ' \
+                  '{5:>14.0f}'.format(key, result['p50'], result['p90'],
+                                      result['p99'], result['frames/s'],
+                                      result['samples/s'])
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key in regressions:
+            print 'REGRESSION', key
+        status = 1 if regressions else 0
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -28,6 +28,8 @@ def main(argv):
     
     if '--analyzer' in argv:
         visualizer = audio.visual.Analyzer()
+    elif '--spectrogram' in argv:
+        visualizer = audio.visual.Spectrogram()
     else:
         visualizer = audio.visual.Oscilloscope('--fill' in argv)
         
@@ -42,14 +44,20 @@ def main(argv):
         source = audio.source.AudioFile(location, emit=True)
 
     window.connect('delete-event', delete_cb, source, loop)
-    source.connect('new-data', new_data_cb, visualizer)
+    if '--analyzer' in argv or '--spectrogram' in argv:
+        # stable fft resolution: 2048 samples per frame, 75% overlap.
+        framer = audio.source.Framer(source, 2048, 512)
+        framer.connect('new-data', new_data_cb, visualizer)
+    else:
+        source.connect('new-data', new_data_cb, visualizer)
 
     window.add(visualizer)
     window.show_all()
 
-    source.start()
-    
+    # visualizers are refreshed from the streaming threads.
     gobject.threads_init()
+    source.start()
+
     loop.run()
     
     return 0
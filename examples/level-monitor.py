@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+import os
+import sys
+
+from numpy import abs
+from numpy import log10
+from numpy import sqrt
+
+import audio.source
+
+
+def decibel(value):
+    return 20 * log10(max(value, 1e-10))
+
+def main(argv):
+    if len(argv) < 2:
+        print "Usage: {0} <source> [<options> ..]".format(sys.argv[0])
+        return 1
+
+    if argv[1] == 'mic':
+        source = audio.source.Microphone(speakers=False)
+    elif argv[1] == 'tone':
+        source = audio.source.Tone(speakers=False)
+    else:
+        location = argv[1]
+        if not location.startswith('/'):
+            location = os.path.join(os.getcwd(), location)
+        source = audio.source.AudioFile(location, offline=True)
+
+    # frames are pulled from the pipeline: no main loop is needed.
+    for frame in source.iter_frames(4410, 4410):
+        rms = sqrt((frame * frame).mean())
+        peak = abs(frame).max()
+        print 'rms {0:6.1f} dB  peak {1:6.1f} dB'.format(decibel(rms),
+                                                        decibel(peak))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -35,7 +35,13 @@ def main(argv):
     window = gtk.Window()
     hbox = gtk.HBox()
 
-    source = audio.source.Tone(emit=True)
+    if '--synth' in argv:
+        source = audio.source.Synthesizer(emit=True)
+    else:
+        source = audio.source.Tone(emit=True)
+    if '--low-latency' in argv:
+        # the pad is played interactively: favor responsiveness.
+        source.set_latency('low')
     pad = audio.tool.Pad()
     hbox.pack_start(pad)
     if '--analyzer' in argv: